@@ -3,32 +3,69 @@
 import asyncio
 
 class Accepter:
-    def __init__(self, connectors, worker, max_conn, loop):
+    def __init__(self, connectors, worker, max_conn, loop, engine='socket', batch=64):
         self.connectors = connectors
         self.worker = worker 
         self.loop = loop
+        self.engine = engine
+        self.batch = max(batch, 1)
         self.sem = asyncio.BoundedSemaphore(max_conn)
         self.alive = True
+        self.tasks = []
 
     def exit(self):
+        '''Stop accepting and close the listening sockets'''
         self.alive = False
+        for task in self.tasks:
+            task.cancel()
+        self.tasks = []
         for connector in self.connectors:
             connector.close()
 
-    def handle(self, client, addr):
-        task = self.loop.create_task(self.worker.process(client))
+    def handle(self, connector, sock, addr):
+        task = self.loop.create_task(self.serve(connector, sock))
         task.add_done_callback(lambda r: self.sem.release())
 
+    async def serve(self, connector, sock):
+        client = await connector.wrap(sock)
+        await self.worker.process(client)
+
     async def accept(self, connector):
         while self.alive:
             await self.sem.acquire()
-            client, addr = await connector.accept()
-            self.handle(client, addr)
+            if not await self.accept_batch(connector):
+                await connector.readable()
+
+    async def accept_batch(self, connector):
+        '''
+            Accept up to `batch` pending connections without going back to
+            the loop, holding one connection slot on entry. Returns the
+            number of connections accepted.
+        '''
+        accepted = 0
+        while True:
+            try:
+                sock, addr = connector.accept_nowait()
+            except (BlockingIOError, InterruptedError):
+                self.sem.release()
+                return accepted
+            except ConnectionAbortedError:
+                continue
+            except OSError:
+                self.sem.release()
+                raise
+
+            self.handle(connector, sock, addr)
+            accepted += 1
+            if accepted >= self.batch or self.sem.locked():
+                return accepted
+            # a free slot is taken without suspending
+            await self.sem.acquire()
 
     def setup(self):
         for connector in self.connectors:
-            connector.open(self.loop)
-            self.loop.create_task(self.accept(connector))
+            connector.open(self.loop, self.engine)
+            self.tasks.append(self.loop.create_task(self.accept(connector)))
 
     def run(self):
         self.setup()
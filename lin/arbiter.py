@@ -2,29 +2,39 @@
 
 import os
 import sys
+import gc
 import time
 import signal
 import errno
+import select
 import queue
 import functools
 import logging
 
 
+from lin.config import Config
 from lin.connector import AsyncConnector
 from lin.manager import Manager
-from lin.utils import daemonize, set_process_owner
+from lin.utils import daemonize, set_process_owner, preload, load_config
 
 
 logger = logging.getLogger(__name__)
 
+# listening sockets passed on to an arbiter executed by SIGUSR2
+LISTEN_FDS = 'LIN_FDS'
+
 class Arbiter:
 
     SIGNALS = {}
 
-    def __init__(self, config):
+    def __init__(self, config, config_file=None, cwd=None):
         self.managers = set()
         self.sig_queue = queue.Queue()
         self.config = config
+        self.config_file = config_file
+        self.cwd = cwd or os.getcwd()
+        self.reexec_pid = None
+        self.reloading = False
 
     def setup(self):
         logger.info("Arbiter booting with pid: {}".format(os.getpid()))
@@ -41,7 +51,36 @@ class Arbiter:
 
         set_process_owner(*self.config.user)
 
-        self.connectors = [AsyncConnector(endpoint, self.config.backlog) for endpoint in self.config.listen]
+        # with reuse_port the managers listen on sockets of their own, these
+        # are only bound to hold the endpoints
+        self.connectors, unused = self.bind(self.config, self.inherit())
+        for connector in unused:
+            connector.close()
+
+        if self.config.preload:
+            self.preload()
+
+    def preload(self):
+        '''load the application before fork'''
+        started = time.time()
+        preload(self.config.handler)
+        # keep the collector from touching, and so copying, the shared objects
+        gc.collect()
+        gc.freeze()
+        logger.info("Preloaded application in {:.3f}s".format(time.time() - started))
+
+    def inherit(self):
+        '''connectors on the sockets passed on by the arbiter that executed this one'''
+        fds = os.environ.pop(LISTEN_FDS, '')
+        return [AsyncConnector.inherit(int(fd), self.config.backlog, self.config.reuse_port)
+                for fd in fds.split(',') if fd]
+
+    def bind(self, config, connectors=()):
+        '''connectors for the endpoints config listens at, reusing the bound ones, and the unused ones'''
+        bound = {connector.endpoint: connector for connector in connectors}
+        connectors = [bound.pop(endpoint, None) or AsyncConnector(endpoint, config.backlog, config.reuse_port)
+                for endpoint in config.listen]
+        return connectors, list(bound.values())
 
     def signal_register(self):
         [signal.signal(sig, self.sig_handler) for sig in self.SIGNALS.keys()]
@@ -87,10 +126,83 @@ class Arbiter:
         '''reload config'''
         self.reload()
 
+    @_signal.__func__(SIGNALS, signal.SIGUSR2)
+    def sigusr2(self):
+        '''upgrade'''
+        self.reexec()
+
     def reload(self):
-        '''reload config'''
-        #TODO
-        pass
+        '''reload config, then replace the managers by a new generation'''
+        if self.config_file is None:
+            logger.warning("No configuration file to reload")
+            return
+
+        logger.info("Reloading configuration file: {}".format(self.config_file))
+        try:
+            os.chdir(self.cwd)
+            # load_config exits on errors
+            config = Config.parse(load_config(self.config_file))
+            connectors, unused = self.bind(config, self.connectors)
+        except (Exception, SystemExit):
+            logger.exception("Failed to reload, keeping the current configuration")
+            os.chdir(self.cwd)
+            os.chdir(self.config.workdir)
+            return
+
+        current = self.config, self.connectors, self.managers
+        self.config, self.connectors, self.managers = config, connectors, set()
+        self.reloading = True
+        try:
+            failed = self.spawn_generation(config.graceful_timeout)
+        finally:
+            self.reloading = False
+
+        if failed:
+            logger.error("{} managers failed to boot, keeping the current configuration".format(failed))
+            started = self.managers
+            self.config, self.connectors, self.managers = current
+            for pid in started:
+                self.kill_manager(pid, signal.SIGQUIT)
+            for connector in connectors:
+                if connector not in self.connectors:
+                    connector.close()
+            os.chdir(self.cwd)
+            os.chdir(self.config.workdir)
+            return
+
+        for connector in unused:
+            connector.close()
+
+        # the old generation finishes the requests in progress once the new
+        # one accepts on the same sockets
+        for pid in current[2]:
+            self.kill_manager(pid, signal.SIGQUIT)
+        logger.info("Listening at: %s", ",".join(['{}:{}'.format(*l) for l in self.config.listen]))
+
+    def reexec(self):
+        '''execute a new arbiter on the listening sockets, this one serves until it is told to quit'''
+        if self.reexec_pid is not None:
+            logger.warning("New arbiter already running with pid: {}".format(self.reexec_pid))
+            return
+
+        pid = os.fork()
+        if pid != 0:
+            self.reexec_pid = pid
+            logger.info("Executing new arbiter with pid: {}".format(pid))
+            return
+
+        try:
+            os.chdir(self.cwd)
+            for connector in self.connectors:
+                os.set_inheritable(connector.fileno(), True)
+            environ = dict(os.environ)
+            environ[LISTEN_FDS] = ','.join(str(connector.fileno()) for connector in self.connectors)
+            argv = getattr(sys, 'orig_argv', [sys.executable] + sys.argv)
+            os.execve(sys.executable, argv, environ)
+        except Exception:
+            logger.exception("Failed to execute new arbiter")
+        finally:
+            os._exit(1)
 
     def reap_managers(self):
         try:
@@ -100,11 +212,19 @@ class Arbiter:
                     break
 
                 exitcode = os.WEXITSTATUS(status)
+                if pid == self.reexec_pid:
+                    logger.info("Reap new arbiter with pid: {} exit code: {}".format(pid, exitcode))
+                    self.reexec_pid = None
+                    continue
+
                 logger.info("Reap manager with pid: {} exit code: {}".format(pid, exitcode))
 
                 if exitcode == Manager.BOOT_ERROR:
                     logger.warning("Manager failed to boot")
-                    sys.exit(-1)
+                    # managers of a reload that failed leave the current
+                    # ones serving
+                    if pid in self.managers and not self.reloading:
+                        sys.exit(-1)
 
                 if pid in self.managers:
                     self.managers.remove(pid)
@@ -113,12 +233,62 @@ class Arbiter:
             if e.errno != errno.ECHILD:
                 raise
 
-    def spawn_manager(self):
+    def spawn_manager(self, pipe=None):
         pid = os.fork()
         if pid != 0:
             return pid
-        manager = Manager(self.connectors, self.config)
-        manager.run()
+
+        # the manager must not return into the arbiter's frames, their
+        # cleanup belongs to the arbiter
+        exitcode = Manager.BOOT_ERROR
+        try:
+            ready = None
+            if pipe is not None:
+                os.close(pipe[0])
+                ready = pipe[1]
+            manager = Manager(self.connectors, self.config, ready)
+            exitcode = 1
+            manager.run()
+        except SystemExit as e:
+            exitcode = e.code if isinstance(e.code, int) else int(e.code is not None)
+        except BaseException:
+            logger.exception("Manager failed with pid: {}".format(os.getpid()))
+        finally:
+            logging.shutdown()
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(exitcode)
+
+    def spawn_generation(self, timeout):
+        '''
+            spawn managers, and wait up to timeout seconds for all of them to
+            accept. Returns the number of managers that exited before.
+        '''
+        # each manager writes a byte once it accepts and closes its copy of
+        # the write end, which exiting does too, so the pipe reads end of
+        # file when all are done
+        rfd, wfd = os.pipe()
+        try:
+            try:
+                for _ in range(self.config.processes):
+                    self.managers.add(self.spawn_manager((rfd, wfd)))
+            finally:
+                os.close(wfd)
+
+            ready = 0
+            deadline = time.time() + timeout
+            while time.time() < deadline:
+                readable, _, _ = select.select([rfd], [], [], max(0, deadline - time.time()))
+                if not readable:
+                    continue
+                data = os.read(rfd, 64)
+                if not data:
+                    return self.config.processes - ready
+                ready += len(data)
+            logger.warning("New managers not ready after {}s".format(timeout))
+            return 0
+        finally:
+            os.close(rfd)
 
     def kill_manager(self, pid, sig):
         try:
@@ -134,11 +304,31 @@ class Arbiter:
 
     def finalize_managers(self, sig):
         '''finalize managers'''
-        for pid in self.managers.copy():
-            if pid in self.managers:
-                self.managers.remove(pid)
+        managers = self.managers.copy()
+        self.managers.clear()
+        for pid in managers:
             self.kill_manager(pid, sig)
+        self.wait_managers(managers, self.config.graceful_timeout + 1)
+
+    def wait_managers(self, managers, timeout):
+        '''wait for managers to exit, and kill those still running after timeout'''
+        deadline = time.time() + timeout
+        while managers and time.time() < deadline:
             time.sleep(0.1)
+            # exited managers are reaped by the SIGCHLD handler
+            managers = {pid for pid in managers if self.manager_alive(pid)}
+
+        for pid in managers:
+            logger.warning("Kill manager with pid: {} after graceful timeout".format(pid))
+            self.kill_manager(pid, signal.SIGKILL)
+
+    @staticmethod
+    def manager_alive(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        return True
 
     def keep_managers(self):
         '''keep managers'''
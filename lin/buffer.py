@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+
+class RecvBuffer:
+    '''
+        A receive buffer backed by a single bytearray with read/write cursors.
+
+        Data is received straight into the free tail of the buffer (see
+        `writable` and `commit`) and handed out as memoryview slices, so no
+        copy is made until a consumer asks for bytes. Views returned by
+        `peek` and `consume` stay valid until the next call to `writable`.
+    '''
+
+    def __init__(self, size):
+        self._buff = bytearray(size)
+        self._view = memoryview(self._buff)
+        self._rpos = 0
+        self._wpos = 0
+
+    def __len__(self):
+        return self._wpos - self._rpos
+
+    def __bool__(self):
+        return self._wpos > self._rpos
+
+    @property
+    def capacity(self):
+        return len(self._buff)
+
+    def writable(self, size):
+        '''Return a writable view of at least `size` bytes at the write cursor'''
+        if self._rpos == self._wpos:
+            self._rpos = self._wpos = 0
+
+        if len(self._buff) - self._wpos >= size:
+            return self._view[self._wpos:]
+
+        length = self._wpos - self._rpos
+        if length + size <= len(self._buff):
+            # compact, the slice is copied first since the ranges may overlap
+            self._buff[:length] = self._buff[self._rpos:self._wpos]
+        else:
+            # never resize in place, consumers may still hold views
+            buff = bytearray(max(len(self._buff) * 2, length + size))
+            buff[:length] = self._view[self._rpos:self._wpos]
+            self._buff = buff
+            self._view = memoryview(buff)
+
+        self._rpos = 0
+        self._wpos = length
+        return self._view[self._wpos:]
+
+    def commit(self, size):
+        '''Mark `size` bytes received into the last writable view as readable'''
+        self._wpos += size
+
+    def write(self, data):
+        size = len(data)
+        self.writable(size)[:size] = data
+        self.commit(size)
+
+    def find(self, sub, start=0):
+        '''Return the offset of `sub` relative to the read cursor, or -1'''
+        idx = self._buff.find(sub, self._rpos + start, self._wpos)
+        return idx - self._rpos if idx >= 0 else -1
+
+    def peek(self, size=None):
+        end = self._wpos if size is None else min(self._rpos + size, self._wpos)
+        return self._view[self._rpos:end]
+
+    def consume(self, size=None):
+        view = self.peek(size)
+        self._rpos += len(view)
+        return view
+
+    def skip(self, size):
+        self._rpos = min(self._rpos + size, self._wpos)
@@ -70,10 +70,13 @@ class CommandInterface:
             sys.exit(0)
 
     def start(self, args):
+        # the config file and workdir are relative to where lin was started,
+        # the arbiter returns there to reload or upgrade
+        cwd = os.getcwd()
         cfg = load_config(args.config)
         config = Config.parse(cfg)
         logger_setup(*config.error_log)
-        arbiter = Arbiter(config)
+        arbiter = Arbiter(config, args.config, cwd)
         arbiter.run()
 
     def run(self, args):
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+from lin.utils import http_date, str_to_bytes
+
+class Clock:
+    '''
+        Wall clock refreshed once a second by the event loop, so that the
+        Date header and the access log timestamp are formatted once per
+        second rather than once per response. Until it is started every
+        access formats the current time.
+    '''
+
+    def __init__(self):
+        self.loop = None
+        self.handle = None
+        self.update()
+
+    @property
+    def running(self):
+        return self.handle is not None
+
+    def update(self):
+        now = time.time()
+        self._http_date = http_date(now)
+        self._date_field = str_to_bytes('Date: {}\r\n'.format(self._http_date))
+        self._time_local = time.strftime('[%d/%b/%Y:%H:%M:%S %z]', time.localtime(now))
+        return now
+
+    def tick(self):
+        now = self.update()
+        # wake up right after the next second boundary
+        self.handle = self.loop.call_later(1 - now % 1, self.tick)
+
+    def start(self, loop):
+        self.loop = loop
+        self.tick()
+
+    def stop(self):
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+
+    @property
+    def http_date(self):
+        if not self.running:
+            self.update()
+        return self._http_date
+
+    @property
+    def date_field(self):
+        '''The encoded Date header field'''
+        if not self.running:
+            self.update()
+        return self._date_field
+
+    @property
+    def time_local(self):
+        if not self.running:
+            self.update()
+        return self._time_local
+
+clock = Clock()
@@ -3,9 +3,11 @@
 import os
 import pwd
 import grp
+import socket
+import importlib.util
 import multiprocessing
 
-from lin.utils import LazyFunction, set_process_workdir
+from lin.utils import LazyFunction, set_process_workdir, load_symbol
 
 from lin.http.handlers.ihandler import IHandler
 
@@ -101,6 +103,38 @@ def handler_validator(value):
         raise TypeError("Not a inject handler: %s" % str(value))
     return value
 
+def parser_validator(value):
+    if not isinstance(value, str):
+        raise TypeError("Not a string: %s" % value)
+    if value == 'httptools' and importlib.util.find_spec('httptools') is None:
+        raise ValueError("Parser not available, httptools is not installed")
+    if value not in ('auto', 'python', 'httptools'):
+        if ':' not in value:
+            raise ValueError("Not a parser name or symbol: %s" % value)
+        try:
+            load_symbol(value)
+        except (ImportError, AttributeError) as e:
+            raise ValueError("Parser not available, %s: %s" % (value, e))
+    return value
+
+def reuse_port_validator(value):
+    value = bool_validator(value)
+    if value and not hasattr(socket, 'SO_REUSEPORT'):
+        raise ValueError("SO_REUSEPORT is not supported on this platform")
+    return value
+
+def engine_validator(value):
+    if value not in ('socket', 'protocol'):
+        raise ValueError("Not a connection engine: %s" % value)
+    return value
+
+def event_loop_validator(value):
+    if value not in ('auto', 'asyncio', 'uvloop'):
+        raise ValueError("Not an event loop: %s" % value)
+    if value == 'uvloop' and importlib.util.find_spec('uvloop') is None:
+        raise ValueError("Event loop not available, uvloop is not installed")
+    return value
+
 def user_validator(value):
     if isinstance(value, str):
         user = value.split(':', 1)
@@ -158,6 +192,15 @@ class Connections(Setting):
     default = 65535
     validator = uint_validator
 
+class AcceptBatch(Setting):
+    '''
+        The maximum number of connections accepted at once when the listener is readable.
+    '''
+
+    name = 'accept_batch'
+    default = 64
+    validator = uint_validator
+
 class Workdir(Setting):
     '''
         The working directory of the application.
@@ -167,6 +210,15 @@ class Workdir(Setting):
     default = '.'
     validator = string_validator
 
+class GracefulTimeout(Setting):
+    '''
+        The number of seconds requests in progress are given to finish on graceful shutdown.
+    '''
+
+    name = 'graceful_timeout'
+    default = 30
+    validator = uint_validator
+
 class Daemon(Setting):
     '''
         Detaches the processes from the controlling terminal.
@@ -239,6 +291,24 @@ class LimitRequestHeader(Setting):
     default = 8192
     validator = uint_validator
 
+class LimitRequestBody(Setting):
+    '''
+        The maximum size of HTTP request body, 0 for unlimited.
+    '''
+
+    name = 'limit_request_body'
+    default = 0
+    validator = uint_validator
+
+class ReusePort(Setting):
+    '''
+        Give each manager its own SO_REUSEPORT listening socket.
+    '''
+
+    name = 'reuse_port'
+    default = False
+    validator = reuse_port_validator
+
 class Sendfile(Setting):
     '''
         Disable the use of sendfile.
@@ -248,6 +318,69 @@ class Sendfile(Setting):
     default = False
     validator = bool_validator
 
+class WriteBufferHigh(Setting):
+    '''
+        The size of response data coalesced before it is written, 0 writes every part at once.
+    '''
+
+    name = 'write_buffer_high'
+    default = 65536
+    validator = uint_validator
+
+class WriteBufferLow(Setting):
+    '''
+        The size of response data left queued when the socket is full before the response resumes.
+    '''
+
+    name = 'write_buffer_low'
+    default = 16384
+    validator = uint_validator
+
+class Pipeline(Setting):
+    '''
+        The maximum number of pipelined requests whose responses are written together.
+    '''
+
+    name = 'pipeline'
+    default = 1
+    validator = uint_validator
+
+class Engine(Setting):
+    '''
+        The connection engine: socket or protocol.
+    '''
+
+    name = 'engine'
+    default = 'socket'
+    validator = engine_validator
+
+class EventLoop(Setting):
+    '''
+        The event loop implementation: auto, asyncio or uvloop.
+    '''
+
+    name = 'event_loop'
+    default = 'auto'
+    validator = event_loop_validator
+
+class Parser(Setting):
+    '''
+        The HTTP parser backend: auto, python, httptools or a symbol.
+    '''
+
+    name = 'parser'
+    default = 'auto'
+    validator = parser_validator
+
+class Preload(Setting):
+    '''
+        Load the application in the arbiter before the managers are forked.
+    '''
+
+    name = 'preload'
+    default = False
+    validator = bool_validator
+
 class Handler(Setting):
     '''
         The handler
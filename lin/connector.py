@@ -3,16 +3,38 @@
 import socket
 
 from lin.sock import AsyncSocketWrapper
+from lin.protocol import ProtocolSocket
 
 class AsyncConnector:
-    def __init__(self, endpoint, backlog):
+    def __init__(self, endpoint, backlog, reuse_port=False, sock=None):
+        self.endpoint = endpoint
         self.backlog = backlog
+        self.reuse_port = reuse_port
+        if sock is not None:
+            self._sock = sock
+            return
         self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         self._sock.bind(endpoint)
 
-    def open(self, loop):
+    @classmethod
+    def inherit(cls, fd, backlog, reuse_port=False):
+        '''Adopt a socket bound by the arbiter this process was executed from'''
+        sock = socket.socket(fileno=fd)
+        return cls(sock.getsockname()[:2], backlog, reuse_port, sock)
+
+    def fileno(self):
+        return self._sock.fileno()
+
+    def duplicate(self):
+        '''Bind another listener to the same endpoint, for SO_REUSEPORT connectors'''
+        return type(self)(self.endpoint, self.backlog, self.reuse_port)
+
+    def open(self, loop, engine='socket'):
         self._loop = loop
+        self._engine = engine
         self._sock.listen(self.backlog)
         self._sock.setblocking(False)
 
@@ -24,7 +46,29 @@ class AsyncConnector:
 
     async def accept(self):
         sock, address = await self._loop.sock_accept(self._sock)
-        return AsyncSocketWrapper(self._loop, sock), address
+        return await self.wrap(sock), address
+
+    def accept_nowait(self):
+        '''Accept a pending connection, raises BlockingIOError when there is none'''
+        sock, address = self._sock.accept()
+        sock.setblocking(False)
+        return sock, address
+
+    async def readable(self):
+        '''Wait for connections to accept'''
+        fd = self._sock.fileno()
+        waiter = self._loop.create_future()
+        self._loop.add_reader(fd, lambda: waiter.done() or waiter.set_result(None))
+        try:
+            await waiter
+        finally:
+            self._loop.remove_reader(fd)
+
+    async def wrap(self, sock):
+        '''Serve an accepted socket with the configured engine'''
+        if self._engine == 'protocol':
+            return await ProtocolSocket.accepted(self._loop, sock)
+        return AsyncSocketWrapper(self._loop, sock)
 
     def close(self):
         self._sock.close()
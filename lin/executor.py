@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import threading
+import collections
+
+from concurrent.futures import Executor, Future
+
+
+class PoolOverload(Exception):
+    def __init__(self, queued):
+        self.queued = queued
+
+    def __str__(self):
+        return "Thread pool overloaded, %d calls pending" % self.queued
+
+
+class WorkItem:
+    __slots__ = ('future', 'fn', 'args', 'kwargs', 'queued_at')
+
+    def __init__(self, future, fn, args, kwargs):
+        self.future = future
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.queued_at = time.monotonic()
+
+    def run(self):
+        if not self.future.set_running_or_notify_cancel():
+            return
+        try:
+            result = self.fn(*self.args, **self.kwargs)
+        except BaseException as e:
+            self.future.set_exception(e)
+        else:
+            self.future.set_result(result)
+
+
+class ThreadPool(Executor):
+    '''
+        Thread pool growing from min_threads up to max_threads while calls
+        are pending, and shrinking back once threads have been idle for
+        idle_timeout seconds. With max_queue set, `submit` raises
+        PoolOverload instead of queueing more than max_queue calls.
+    '''
+
+    # weight of the latest call in the smoothed queue wait time
+    WAIT_SMOOTHING = 0.1
+
+    def __init__(self, min_threads=0, max_threads=None, max_queue=0, idle_timeout=60, name='lin-pool'):
+        if max_threads is None:
+            max_threads = min(32, (os.cpu_count() or 1) + 4)
+        if max_threads <= 0:
+            raise ValueError("max_threads must be greater than 0")
+
+        self.min_threads = min(min_threads, max_threads)
+        self.max_threads = max_threads
+        self.max_queue = max_queue
+        self.idle_timeout = idle_timeout
+        self.name = name
+
+        self._cond = threading.Condition()
+        self._queue = collections.deque()
+        self._threads = set()
+        self._idle = 0
+        self._starting = 0
+        self._active = 0
+        self._completed = 0
+        self._rejected = 0
+        self._wait_time = 0.0
+        self._shutdown = False
+        self._counter = 0
+
+        with self._cond:
+            for _ in range(self.min_threads):
+                self._spawn()
+
+    def _spawn(self):
+        self._counter += 1
+        self._starting += 1
+        thread = threading.Thread(target=self._work, name='{}-{}'.format(self.name, self._counter), daemon=True)
+        self._threads.add(thread)
+        thread.start()
+
+    def _work(self):
+        thread = threading.current_thread()
+        with self._cond:
+            self._starting -= 1
+        while True:
+            with self._cond:
+                while not self._queue and not self._shutdown:
+                    self._idle += 1
+                    woken = self._cond.wait(self.idle_timeout)
+                    self._idle -= 1
+                    if not woken and not self._queue and len(self._threads) > self.min_threads:
+                        self._threads.discard(thread)
+                        return
+
+                if not self._queue:
+                    self._threads.discard(thread)
+                    return
+
+                item = self._queue.popleft()
+                self._active += 1
+                wait = time.monotonic() - item.queued_at
+                self._wait_time += (wait - self._wait_time) * self.WAIT_SMOOTHING
+
+            item.run()
+            del item
+
+            with self._cond:
+                self._active -= 1
+                self._completed += 1
+
+    def _submit(self, fn, args, kwargs, limit):
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError('cannot schedule new calls after shutdown')
+            if limit and self._backlog() >= limit:
+                self._rejected += 1
+                raise PoolOverload(len(self._queue))
+
+            future = Future()
+            self._queue.append(WorkItem(future, fn, args, kwargs))
+            if self._backlog() > 0 and len(self._threads) < self.max_threads:
+                self._spawn()
+            self._cond.notify()
+            return future
+
+    def _backlog(self):
+        # calls no idle or starting thread is about to pick up
+        return len(self._queue) - self._idle - self._starting
+
+    def submit(self, fn, /, *args, **kwargs):
+        return self._submit(fn, args, kwargs, self.max_queue)
+
+    def submit_unbounded(self, fn, /, *args, **kwargs):
+        '''Submit a call that must not be refused, such as the rest of a started response'''
+        return self._submit(fn, args, kwargs, 0)
+
+    def overloaded(self):
+        return bool(self.max_queue) and self._backlog() >= self.max_queue
+
+    def stats(self):
+        with self._cond:
+            return {
+                    'threads': len(self._threads),
+                    'idle': self._idle,
+                    'active': self._active,
+                    'queued': len(self._queue),
+                    'completed': self._completed,
+                    'rejected': self._rejected,
+                    'wait_time': self._wait_time,
+                    }
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        with self._cond:
+            self._shutdown = True
+            if cancel_futures:
+                while self._queue:
+                    self._queue.popleft().future.cancel()
+            self._cond.notify_all()
+            threads = list(self._threads)
+
+        if wait:
+            for thread in threads:
+                thread.join()
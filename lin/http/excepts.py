@@ -25,6 +25,13 @@ class LimitRequestHeader(Exception):
     def __str__(self):
         return "Request Header is too large (%d)" % self.size
 
+class LimitRequestBody(Exception):
+    def __init__(self, size):
+        self.size = size
+
+    def __str__(self):
+        return "Request Body is too large (%d)" % self.size
+
 class InvalidHeader(Exception):
     def __init__(self, header):
         self.header = header
@@ -32,6 +39,13 @@ class InvalidHeader(Exception):
     def __str__(self):
         return "Invalid HTTP Header: %s" % self.header 
 
+class InvalidRequestLine(Exception):
+    def __init__(self, line):
+        self.line = line
+
+    def __str__(self):
+        return "Invalid HTTP request line: %s" % self.line
+
 class InvalidRequestMethod(Exception):
     def __init__(self, method):
         self.method = method
@@ -39,6 +53,13 @@ class InvalidRequestMethod(Exception):
     def __str__(self):
         return "Invalid HTTP method: %s" % self.method
 
+class InvalidHTTPVersion(Exception):
+    def __init__(self, version):
+        self.version = version
+
+    def __str__(self):
+        return "Invalid HTTP version: %s" % self.version
+
 class InvalidChunk(Exception):
     def __init__(self, chunk):
         self.chunk = chunk
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+
+from http import HTTPStatus
+from urllib.parse import unquote
+
+from lin.utils import bytes_to_str, str_to_bytes
+from lin.http.handlers.ihandler import IHandler
+
+from lin.utils import load_symbol
+
+def address(addr):
+    # (host, port) for inet sockets, None for unix sockets
+    return tuple(addr[:2]) if isinstance(addr, tuple) else None
+
+class ASGIHandler(IHandler):
+    '''
+        Runs ASGI (3.0) applications on the manager's event loop, with
+        `receive` reading the request body and `send` writing the response.
+        Only the http scope is supported.
+    '''
+
+    def __init__(self, application, root_path=''):
+        self.app = load_symbol(application)
+        self.root_path = root_path
+
+    @classmethod
+    def preload(cls, application, **kwargs):
+        '''Import the application in the arbiter, managers forked after share it'''
+        load_symbol(application)
+
+    def scope_create(self, request):
+        path, _, query = request.uri.partition('?')
+        return {
+                'type': 'http',
+                'asgi': {'version': '3.0', 'spec_version': '2.3'},
+                'http_version': request.version[5:],
+                'method': request.method,
+                'scheme': 'http',
+                'path': unquote(path),
+                'raw_path': str_to_bytes(path, 'latin1'),
+                'query_string': str_to_bytes(query, 'latin1'),
+                'root_path': self.root_path,
+                'headers': [(str_to_bytes(k.lower(), 'latin1'), str_to_bytes(v, 'latin1')) for k, v in request.header],
+                'client': address(request.remote_addr),
+                'server': address(request.local_addr),
+                }
+
+    async def handle(self, request, response):
+        body = request.body
+        buffer_size = request.reader.buffer_size
+        # set once the response is complete, a pending receive then
+        # reports the disconnect
+        finished = asyncio.get_running_loop().create_future()
+        state = {'started': False, 'complete': False, 'received': False}
+
+        async def receive():
+            if not state['received']:
+                data = await body.read_some(buffer_size) if not body.eof else b''
+                state['received'] = body.eof
+                return {'type': 'http.request', 'body': data, 'more_body': not body.eof}
+            await finished
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            if state['complete']:
+                raise RuntimeError('response already complete')
+
+            if message['type'] == 'http.response.start':
+                if state['started']:
+                    raise RuntimeError('response already started')
+                status = message['status']
+                try:
+                    phrase = HTTPStatus(status).phrase
+                except ValueError:
+                    phrase = 'Unknown'
+                response.status = '{} {}'.format(status, phrase)
+                for name, value in message.get('headers', ()):
+                    response.header.add(bytes_to_str(name), bytes_to_str(value))
+                state['started'] = True
+
+            elif message['type'] == 'http.response.body':
+                if not state['started']:
+                    raise RuntimeError('response not started')
+                data = message.get('body', b'')
+                more_body = message.get('more_body', False)
+
+                if not response.header_sent and 'Content-Length' not in response.header:
+                    if not more_body:
+                        # the whole body is known, no need to frame it
+                        response.header.set('Content-Length', str(len(data)))
+                    elif response.version >= 'HTTP/1.1':
+                        response.header.set('Transfer-Encoding', 'chunked')
+                    else:
+                        response.should_close = True
+
+                await response.write(data)
+                if not more_body:
+                    state['complete'] = True
+                    finished.set_result(None)
+
+        try:
+            await self.app(self.scope_create(request), receive, send)
+        finally:
+            if not finished.done():
+                finished.set_result(None)
+
+        if not state['started']:
+            raise RuntimeError('ASGI application returned without a response')
+
+        if not state['complete']:
+            if not response.header_sent and 'Content-Length' not in response.header:
+                response.header.set('Content-Length', '0')
+            elif not response.chunked:
+                # the client cannot tell where a truncated body ends
+                response.should_close = True
+
+        # the last chunk, if any, is written by Response.flush
+        response.body([])
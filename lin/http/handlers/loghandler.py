@@ -3,6 +3,7 @@
 import os
 import time
 
+from lin.clock import clock
 from lin.http.handlers.ihandler import IHandler
 from lin.logger import Logger
 
@@ -17,14 +18,14 @@ class LogHandler(IHandler):
         atoms = {
                 'remote_addr': response.writer.remote_addr,
                 'server_addr': response.writer.local_addr,
-                'time_local': time.strftime('[%d/%b/%Y:%H:%M:%S %z]'),
+                'time_local': clock.time_local,
                 'request_method': request.method,
                 'request_uri': request.uri,
                 'request_time': time.time() - request.initial_time,
                 'http_user_agent': request.header.get('user-agent'),
-                'http_x_forwarded_for':request.header.get('x-forwarded-for') if request.header.get('x-forwarded-for') else '-',
-                'http_referer': request.header.get('referer') if request.header.get('referer') else '-',
-                'http_host': request.header.get('host') if request.header.get('host') else '-',
+                'http_x_forwarded_for': request.header.get('x-forwarded-for', default='-'),
+                'http_referer': request.header.get('referer', default='-'),
+                'http_host': request.header.get('host', default='-'),
                 'status': response.status,
                 'scheme': 'http',
                 'pid': os.getpid(),
@@ -1,57 +1,101 @@
 # -*- coding: utf-8 -*-
 
-import sys
 import asyncio
 import logging
+import tempfile
 import itertools
+import threading
+import collections
+import multiprocessing
 
 from io import BytesIO
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
 from urllib.parse import urlsplit
 
 from lin.version import __SERVER_NAME__
 from lin.utils import bytes_to_str, str_to_bytes, http_date
 from lin.http.handlers.ihandler import IHandler
 from lin.http.response import Response, IWriter
+from lin.executor import ThreadPool, PoolOverload
 
 from lin.utils import load_symbol
 
 logger = logging.getLogger(__name__)
 
+# environ keys by header name, grown as names are seen
+ENVIRON_KEYS = {
+        'Content-Type': 'CONTENT_TYPE',
+        'Content-Length': 'CONTENT_LENGTH',
+        }
+ENVIRON_KEYS_LIMIT = 1024
+
+def environ_key(name):
+    key = ENVIRON_KEYS.get(name)
+    if key is None:
+        key = name.upper().replace('-', '_')
+        if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            key = 'HTTP_' + key
+        if len(ENVIRON_KEYS) < ENVIRON_KEYS_LIMIT:
+            ENVIRON_KEYS[name] = key
+    return key
+
 class WSGIReader:
-    def __init__(self, reader):
-        self.reader = reader
-        self.buff = BytesIO()
+    '''
+        Blocking wsgi.input for application threads, bridged onto the
+        asynchronous request body running in the event loop.
+    '''
+
+    def __init__(self, body, loop, block_size=8192):
+        self.body = body
+        self.loop = loop
+        self.block_size = block_size
+        self.buff = bytearray()
+
+    def _read(self, size):
+        return asyncio.run_coroutine_threadsafe(self.body.read(size), self.loop).result()
+
+    def _take(self, size):
+        data = bytes(self.buff[:size])
+        del self.buff[:size]
+        return data
 
     def read(self, size=None):
-        if not isinstance(size, int):
+        if size is not None and not isinstance(size, int):
             raise TypeError("size must be an integral type") 
 
         if size is None or size < 0:
-            size =  sys.maxsize
-
-        data = self.buff.getvalue()
-        if len(data) == 0:
-            return self.reader.read(size)
-        else:
-            remain_data = self.reader.read(size - len(data))
-            self.buff = BytesIO()
-            return data + remain_data
+            return self._take(len(self.buff)) + self._read(-1)
 
+        while len(self.buff) < size:
+            part = self._read(size - len(self.buff))
+            if not part:
+                break
+            if not self.buff and len(part) == size:
+                return part
+            self.buff += part
+        return self._take(size)
 
     def readline(self, size = None):
+        start = 0
         while True:
-            data = self.buff.getvalue()
-            idx = data.find(b'\n')
-            if idx > 0:
-                self.buff = BytesIO()
-                self.buff.write(data[idx:])
-                return data[:idx]
-            part = self.reader.read(1024)
-            if len(part) == 0:
-                self.buff = BytesIO()
-                return data
-            self.buff.write(part)
+            idx = self.buff.find(b'\n', start)
+            if idx >= 0:
+                end = idx + 1
+                break
+            if size is not None and 0 <= size <= len(self.buff):
+                end = size
+                break
+            start = len(self.buff)
+            part = self._read(self.block_size)
+            if not part:
+                end = len(self.buff)
+                break
+            self.buff += part
+        if size is not None and size >= 0:
+            end = min(end, size)
+        return self._take(end)
 
     def readlines(self, hint = None):
         lines = []
@@ -107,14 +151,179 @@ class FileWrapper(IWriter):
         if hasattr(self.filelike, 'close'):
             self.filelike.close()
 
+class PoolIterator:
+    '''
+        Async iterator over a WSGI response iterable advanced in the thread
+        pool. A pool thread prefetches parts into a queue bounded by `limit`
+        bytes, and the event loop takes everything queued each time it wakes.
+    '''
+
+    def __init__(self, iterable, loop, pool, limit=65536):
+        self.iterable = iterable
+        self.loop = loop
+        self.pool = pool
+        self.limit = limit
+        self.cond = threading.Condition()
+        self.parts = collections.deque()
+        self.size = 0
+        self.done = False
+        self.closed = False
+        self.error = None
+        self.waiter = None
+        self.future = None
+
+    def _wake(self, waiter):
+        if not waiter.done():
+            waiter.set_result(None)
+
+    def _notify(self):
+        # called in the pool thread with the condition held
+        waiter, self.waiter = self.waiter, None
+        if waiter is not None:
+            try:
+                self.loop.call_soon_threadsafe(self._wake, waiter)
+            except RuntimeError:
+                # the loop is closed
+                pass
+
+    def produce(self):
+        try:
+            for part in self.iterable:
+                with self.cond:
+                    self.cond.wait_for(lambda: self.size < self.limit or self.closed)
+                    if self.closed:
+                        return
+                    self.parts.append(part)
+                    self.size += len(part)
+                    self._notify()
+        except BaseException as e:
+            self.error = e
+        finally:
+            with self.cond:
+                self.done = True
+                self._notify()
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        self.future = asyncio.wrap_future(self.pool.submit_unbounded(self.produce), loop=self.loop)
+        while True:
+            with self.cond:
+                if self.parts:
+                    parts = self.parts
+                    self.parts = collections.deque()
+                    self.size = 0
+                    self.cond.notify()
+                elif self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                else:
+                    parts = None
+                    waiter = self.waiter = self.loop.create_future()
+
+            if parts is None:
+                await waiter
+                continue
+
+            for part in parts:
+                yield part
+
+    async def aclose(self):
+        '''Stop prefetching and close the iterable in the pool'''
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        if self.future is not None:
+            await self.future
+        if hasattr(self.iterable, 'close'):
+            await asyncio.wrap_future(self.pool.submit_unbounded(self.iterable.close), loop=self.loop)
+
+
+# the application of a pool process
+process_app = None
+
+# request body bytes kept in memory for a pool process without body_buffer_size
+PROCESS_BODY_BUFFER = 1048576
+
+def process_init(application):
+    global process_app
+    process_app = load_symbol(application)
+
+def process_call(environ, body):
+    '''
+        Run the application in a pool process and return its status, headers
+        and body, the whole response is sent back at once. The request body
+        is passed as bytes, or as the name of the file it was spooled to.
+    '''
+    state = {}
+    parts = []
+    def start_response(status, headers, exc_info=None):
+        if exc_info:
+            try:
+                if 'status' in state and parts:
+                    raise exc_info[1].with_traceback(exc_info[2])
+            finally:
+                exc_info = None
+        elif 'status' in state:
+            raise AssertionError("response header already set")
+        state['status'] = status
+        state['headers'] = list(headers)
+        return parts.append
+
+    environ['wsgi.input'] = BytesIO(body) if isinstance(body, bytes) else open(body, 'rb')
+    try:
+        bodyiter = process_app(environ, start_response)
+        try:
+            for part in bodyiter:
+                parts.append(part)
+        finally:
+            if hasattr(bodyiter, 'close'):
+                bodyiter.close()
+    finally:
+        environ['wsgi.input'].close()
+
+    if 'status' not in state:
+        raise AssertionError("response status not set")
+    return state['status'], state['headers'], b''.join(parts)
+
 
 class WSGIHandler(IHandler):
 
-    def __init__(self, application, workers=None):
-        self.app = load_symbol(application)
-        self.pool = ThreadPoolExecutor(workers)
+    def __init__(self, application, workers=None, body_buffer_size=0,
+            min_workers=0, max_pending=0, idle_timeout=60, executor='thread'):
+        if executor == 'thread':
+            self.app = load_symbol(application)
+            self.pool = ThreadPool(min_workers, workers, max_pending, idle_timeout, name='lin-wsgi')
+        elif executor == 'process':
+            # each manager runs a pool, the managers already take a core each
+            workers = workers or 1
+            self.app = None
+            self.pool = self.process_pool(application, workers)
+        else:
+            raise ValueError("Invalid executor: %s" % executor)
+        self.application = application
+        self.workers = workers
+        self.executor = executor
+        self.max_pending = max_pending
+        self.pending = 0
         self.loop = asyncio.get_running_loop()
-
+        self.body_buffer_size = body_buffer_size
+        # environ templates by local address
+        self.templates = {}
+
+    @staticmethod
+    def process_pool(application, workers):
+        # fresh interpreters, forking a manager would copy its loop and listeners
+        return ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'),
+                initializer=process_init, initargs=(application,))
+
+    @classmethod
+    def preload(cls, application, executor='thread', **kwargs):
+        '''Import the application in the arbiter, managers forked after share it'''
+        if executor == 'thread':
+            load_symbol(application)
 
     def __del__(self):
         self.pool.shutdown()
@@ -127,33 +336,50 @@ class WSGIHandler(IHandler):
                 'wsgi.multiprocess': True,
                 'wsgi.run_once': False,
                 'wsgi.file_wrapper': FileWrapper,
+                'wsgi.errors': WSGIError(logger),
+                'SCRIPT_NAME': '',
+                'SERVER_SOFTWARE': __SERVER_NAME__,
                 }
 
+    def environ_template(self, local_addr):
+        '''The environ keys shared by every request on a listener'''
+        template = self.templates.get(local_addr)
+        if template is None:
+            template = self.default_environ()
+            if isinstance(local_addr, tuple):
+                template['SERVER_NAME'] = local_addr[0]
+                template['SERVER_PORT'] = str(local_addr[1])
+            else:
+                # unix socket
+                template['SERVER_NAME'] = local_addr
+                template['SERVER_PORT'] = ''
+            self.templates[local_addr] = template
+        return template
+
     def environ_create(self, request):
-        uriparts = urlsplit(request.uri)
-        environ = self.default_environ()
-        environ.update(
-                {
-                    'wsgi.input': WSGIReader(request.body),
-                    'wsgi.errors': WSGIError(logger),
-                    'SCRIPT_NAME': '',
-                    'REQUEST_METHOD': request.method,
-                    'PATH_INFO': uriparts.path,
-                    'QUERY_STRING': uriparts.query,
-                    'SERVER_NAME': request.local_addr[0],
-                    'SERVER_PORT': str(request.local_addr[1]),
-                    'SERVER_PROTOCOL': request.version,
-                    'SERVER_SOFTWARE': __SERVER_NAME__,
-                    }
-                )
-
-        for field in request.header:
-            if field[0].upper() == 'CONTENT-TYPE':
-                environ['CONTENT_TYPE'] = field[1]
-            elif field[0].upper() == 'CONTENT-LENGTH':
-                environ['CONTENT_LENGTH'] = field[1]
+        uri = request.uri
+        if uri.startswith('/'):
+            path, _, query = uri.partition('?')
+            if '#' in query:
+                query = query.partition('#')[0]
+        else:
+            uriparts = urlsplit(uri)
+            path, query = uriparts.path, uriparts.query
+
+        environ = self.environ_template(request.local_addr).copy()
+        environ['wsgi.input'] = WSGIReader(request.body, self.loop)
+        environ['REQUEST_METHOD'] = request.method
+        environ['PATH_INFO'] = path
+        environ['QUERY_STRING'] = query
+        environ['SERVER_PROTOCOL'] = request.version
+
+        for name, value in request.header:
+            key = environ_key(name)
+            if key in environ:
+                # repeated fields are joined as in CGI
+                environ[key] += ',' + value
             else:
-                environ['HTTP_{}'.format(field[0].replace('-', '_').upper())] = field[1]
+                environ[key] = value
 
         return environ
 
@@ -177,10 +403,115 @@ class WSGIHandler(IHandler):
 
         return environ, start_response
 
+    async def spool(self, body):
+        '''
+            Read the request body on the event loop, keeping up to
+            body_buffer_size bytes in memory and spilling the rest to a
+            temporary file, so no thread waits on a slow upload.
+        '''
+        spool = tempfile.SpooledTemporaryFile(self.body_buffer_size)
+        async for part in body:
+            spool.write(part)
+        spool.seek(0)
+        return spool
+
+    async def spool_named(self, body):
+        '''
+            Read the request body for a pool process, keeping up to
+            body_buffer_size bytes in memory and spilling larger bodies to a
+            named temporary file the process opens. Returns the bytes, or
+            the file.
+        '''
+        limit = self.body_buffer_size or PROCESS_BODY_BUFFER
+        data = bytearray()
+        spool = None
+        async for part in body:
+            if spool is None and len(data) + len(part) > limit:
+                spool = tempfile.NamedTemporaryFile(prefix='lin-body-')
+                spool.write(data)
+                data = None
+            if spool is None:
+                data += part
+            else:
+                spool.write(part)
+        if spool is None:
+            return bytes(data)
+        spool.flush()
+        return spool
+
+    def stats(self):
+        '''Thread pool metrics: threads, idle, active, queued, completed, rejected, wait_time'''
+        if self.executor == 'process':
+            return {'pending': self.pending, 'queued': max(self.pending - self.workers, 0)}
+        return self.pool.stats()
+
+    def overloaded(self, response):
+        logger.warning('WSGI pool overloaded: {}'.format(self.stats()))
+        content = b'Service Unavailable'
+        response.status = '503 Service Unavailable'
+        response.header.set('Content-Type', 'text/plain')
+        response.header.set('Content-Length', str(len(content)))
+        response.header.set('Retry-After', '1')
+        # the request body is left unread
+        response.should_close = True
+        response.body([content])
+
+    async def handle_in_process(self, request, response):
+        # as with threads, max_pending bounds the calls waiting for a process
+        if self.max_pending and self.pending - self.workers >= self.max_pending:
+            return self.overloaded(response)
+
+        self.pending += 1
+        try:
+            environ = self.environ_create(request)
+            # the body is read on the loop and sent along with the environ
+            del environ['wsgi.input']
+            environ['wsgi.multithread'] = False
+            body = await self.spool_named(request.body)
+            pool = self.pool
+            try:
+                status, headers, content = await self.loop.run_in_executor(pool, process_call, environ,
+                        body if isinstance(body, bytes) else body.name)
+            except BrokenProcessPool:
+                # a process died and the pool refuses every call from now
+                # on, later requests get a new one
+                if self.pool is pool:
+                    logger.warning('WSGI process pool broken, starting a new one')
+                    self.pool = self.process_pool(self.application, self.workers)
+                    pool.shutdown(wait=False)
+                raise
+            finally:
+                if not isinstance(body, bytes):
+                    body.close()
+        finally:
+            self.pending -= 1
+
+        response.status = status
+        response.header.update(headers)
+        if 'Content-Length' not in response.header and not response.chunked:
+            response.header.set('Content-Length', str(len(content)))
+        response.body([content])
+
     async def handle(self, request, response):
+        if self.executor == 'process':
+            return await self.handle_in_process(request, response)
+
         environ, start_response = self.wsgi_create(request, response)
-        bodyiter = await self.loop.run_in_executor(self.pool, self.app, environ, start_response)
-        if isinstance(bodyiter, FileWrapper):
+        if self.body_buffer_size and request.has_body():
+            if self.pool.overloaded():
+                # do not spool a body the pool has no room for
+                return self.overloaded(response)
+            environ['wsgi.input'] = await self.spool(request.body)
+        try:
+            future = self.pool.submit(self.app, environ, start_response)
+        except PoolOverload:
+            return self.overloaded(response)
+        bodyiter = await asyncio.wrap_future(future, loop=self.loop)
+        if isinstance(bodyiter, (list, tuple)):
+            # nothing left to compute, no need for a thread hop
+            response.body(bodyiter)
+        elif isinstance(bodyiter, FileWrapper) and response.sendfile:
             response.body = bodyiter
         else:
-            response.body(bodyiter)
+            # generators may block, keep them off the event loop
+            response.body(PoolIterator(bodyiter, self.loop, self.pool))
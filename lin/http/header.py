@@ -1,20 +1,77 @@
 # -*- coding: utf-8 -*-
 
 from lin.utils import str_to_bytes
+from lin.version import __SERVER_NAME__
+
+COMMON_NAMES = (
+        'Accept', 'Accept-Charset', 'Accept-Encoding', 'Accept-Language',
+        'Authorization', 'Cache-Control', 'Connection', 'Content-Encoding',
+        'Content-Length', 'Content-Type', 'Cookie', 'Date', 'Etag', 'Expect',
+        'Host', 'If-Modified-Since', 'If-None-Match', 'Last-Modified', 'Origin',
+        'Pragma', 'Range', 'Referer', 'Server', 'Set-Cookie', 'Transfer-Encoding',
+        'Upgrade', 'Upgrade-Insecure-Requests', 'User-Agent', 'Via',
+        'X-Forwarded-For', 'X-Forwarded-Host', 'X-Forwarded-Proto', 'X-Real-Ip',
+        'X-Requested-With',
+        )
+
+COMMON_VALUES = (
+        '*/*', '0', '1', '100-continue', 'application/json', 'br', 'chunked',
+        'close', 'deflate', 'gzip', 'gzip, deflate', 'gzip, deflate, br',
+        'identity', 'keep-alive', 'max-age=0', 'no-cache', 'text/html',
+        'text/plain', 'text/plain; charset=utf-8', 'XMLHttpRequest',
+        __SERVER_NAME__,
+        )
+
+# received bytes to the shared str, for names in canonical and lower case
+NAMES = {spelling.encode('latin1'): name for name in COMMON_NAMES for spelling in (name, name.lower())}
+
+VALUES = {value.encode('latin1'): value for value in COMMON_VALUES}
+
+# index keys of the common names
+LOWER_NAMES = {name: name.lower() for name in COMMON_NAMES}
+
+# pre-encoded fields written on most responses
+FIELDS = {(name, value): '{}: {}\r\n'.format(name, value).encode('latin1') for name, value in (
+        ('Server', __SERVER_NAME__),
+        ('Connection', 'keep-alive'),
+        ('Connection', 'close'),
+        ('Transfer-Encoding', 'chunked'),
+        ('Content-Type', 'text/html'),
+        ('Content-Type', 'text/plain'),
+        ('Content-Type', 'text/plain; charset=utf-8'),
+        ('Content-Type', 'application/json'),
+        )}
+
+def lower_name(name):
+    return LOWER_NAMES.get(name) or name.lower()
+
+def field_to_bytes(field):
+    return FIELDS.get(field) or str_to_bytes('{}: {}\r\n'.format(*field))
 
 class Header:
+    '''
+        Ordered multi-dict of header fields. Lookups go through an index of
+        lowercased names built when the fields are added, and the encoded
+        form is cached until the fields change.
+    '''
+
     def __init__(self, fields = None):
-        self._fields = fields if fields else []
+        self._fields = list(fields) if fields else []
+        self._bytes = None
+        self._reindex()
 
-    def _get(self, key):
-        key = key.lower()
+    def _reindex(self):
+        self._index = {}
         for k, v in self._fields:
-            if k.lower() == key:
-                return v
+            self._index.setdefault(lower_name(k), []).append(v)
+
+    def _get(self, key):
+        values = self._index.get(lower_name(key))
+        if values:
+            return values[0]
 
     def get_all(self, key):
-        key = key.lower()
-        return [v for k, v in self._fields if k.lower() == key]
+        return list(self._index.get(lower_name(key), ()))
 
     def get(self, key, type = None, default = None):
         rv = self._get(key)
@@ -27,18 +84,55 @@ class Header:
             return rv
         return default
 
-    def set(self, key, value):
+    def add(self, key, value):
+        '''Append a field, keeping any others with the same name'''
         self._fields.append((key, value))
+        self._index.setdefault(lower_name(key), []).append(value)
+        self._bytes = None
+
+    def set(self, key, value):
+        '''Set a field, dropping any others with the same name'''
+        if lower_name(key) in self._index:
+            self.delete(key)
+        self.add(key, value)
+
+    def replace(self, key, value):
+        '''Replace the value of an existing field in place'''
+        lkey = lower_name(key)
+        if lkey not in self._index:
+            raise KeyError(key)
+        fields = []
+        for k, v in self._fields:
+            if lower_name(k) != lkey:
+                fields.append((k, v))
+            elif lkey in self._index:
+                fields.append((k, value))
+                del self._index[lkey]
+        self._fields = fields
+        self._index[lkey] = [value]
+        self._bytes = None
 
     def update(self, fields):
-        self._fields += fields
+        for key, value in fields:
+            self.add(key, value)
 
     def delete(self, key):
-        key = key.lower()
-        self._fields = [field for field in self._fields if key != field[0].lower()]
+        key = lower_name(key)
+        if self._index.pop(key, None) is None:
+            return
+        self._fields = [field for field in self._fields if key != lower_name(field[0])]
+        self._bytes = None
 
     def to_bytes(self):
-        return str_to_bytes('\r\n'.join(['{}: {}'.format(*field) for field in self._fields]) + '\r\n\r\n')
+        if self._bytes is None:
+            self._bytes = b''.join([field_to_bytes(field) for field in self._fields]) + b'\r\n'
+        return self._bytes
+
+    def __contains__(self, key):
+        return lower_name(key) in self._index
+
+    def __len__(self):
+        return len(self._fields)
 
     def __iter__(self):
         yield from self._fields
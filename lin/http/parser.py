@@ -1,144 +1,300 @@
 # -*- coding: utf-8 -*-
 
-from io import BytesIO
+try:
+    import httptools
+except ImportError:
+    httptools = None
 
-from lin.utils import bytes_to_str, str_to_bytes, http_date
+from lin.buffer import RecvBuffer
+from lin.utils import bytes_to_str, str_to_bytes, http_date, load_symbol
 
 from lin.version import __SERVER_NAME__
-from lin.http.header import Header
+from lin.http.header import Header, NAMES, VALUES
 from lin.http.request import Request
 from lin.http.response import Response
-from lin.http.excepts import NoMoreData, LimitRequestLine, InvalidRequestMethod, OverflowException
+from lin.http.excepts import (
+        NoMoreData, OverflowException, LimitRequestLine, LimitRequestHeader,
+        InvalidRequestLine, InvalidRequestMethod, InvalidHTTPVersion, InvalidHeader
+        )
 
 
+# the most a read skipping the buffer asks the socket for
+RECV_SIZE = 65536
+
 class Reader:
     def __init__(self, sock, buffer_size):
         self.sock = sock
-        self.buff = BytesIO()
+        self.buff = RecvBuffer(buffer_size)
         self.buffer_size = buffer_size
+        self._scanned = 0
 
-    def read_line(self):
-        while True:
-            data = self.buff.getvalue()
-            idx = data.find(b'\r\n')
-            if idx >= 0:
-                self.buff = BytesIO()
-                self.buff.write(data[idx + 2:])
-                return data[:idx + 2]
-            part = self.sock.blocking_read(5)
-            self.buff.write(part)
-
-    def read(self, size, timeout = None):
-        pre_size = len(self.buff.getvalue())
-        if pre_size >= size > 0:
-            data = self.buff.getvalue()
-            self.buff = BytesIO()
-            self.buff.write(data[size:])
-            return data[:size]
-        else:
-            part = self.sock.blocking_read(size - pre_size, timeout)
-            if pre_size == 0:
-                return part
-            else:
-                self.buff.write(part)
-                data = self.buff.getvalue()
-                self.buff = BytesIO()
+    async def read(self, size):
+        '''Read at most `size` bytes, waiting for at least one'''
+        if not self.buff:
+            if size >= self.buffer_size:
+                # large reads skip the buffer, a bounded amount at a time
+                data = await self.sock.recv(min(size, max(self.buffer_size, RECV_SIZE)))
+                if not data:
+                    raise NoMoreData()
                 return data
+            await self.read_part()
+        return bytes(self.buff.consume(size))
+
+    async def read_line(self, limit=0):
+        '''Read a CRLF terminated line, returned without the CRLF'''
+        return bytes(await self.find(b'\r\n', limit))
 
     async def preread(self, timeout):
-        data = await self.sock.recv_timeout(self.buffer_size, timeout)
-        if not data:
+        # pipelined requests may already be buffered
+        if self.buff:
+            return
+        nbytes = await self.sock.recv_into_timeout(self.buff.writable(self.buffer_size), timeout)
+        if not nbytes:
             raise NoMoreData()
-        self.buff.write(data)
+        self.buff.commit(nbytes)
 
     async def read_part(self):
-        data = await self.sock.recv(self.buffer_size)
-        if not data:
+        nbytes = await self.sock.recv_into(self.buff.writable(self.buffer_size))
+        if not nbytes:
             raise NoMoreData()
-        self.buff.write(data)
+        self.buff.commit(nbytes)
 
     async def find(self, substr, limit):
         while True:
-            data = self.buff.getvalue()
-            idx = data.find(substr)
+            # resume where the last search stopped, a delimiter may straddle reads
+            idx = self.buff.find(substr, max(self._scanned - len(substr) + 1, 0))
             if idx >= 0:
                 if idx > limit > 0:
                     raise OverflowException(limit)
                 break
-            elif len(data) > limit > 0:
+            elif len(self.buff) > limit > 0:
                 raise OverflowException(limit)
+            self._scanned = len(self.buff)
             await self.read_part()
-        self.buff = BytesIO()
-        self.buff.write(data[idx + len(substr):])
-        return data[:idx]
-        
+        self._scanned = 0
+        data = self.buff.consume(idx)
+        self.buff.skip(len(substr))
+        return data
+
 class HTTP_v1_x_Parser:
 
     VERSIONS = ('HTTP/1.0', 'HTTP/1.1')
     METHODS = ('GET', 'POST', 'HEAD', 'OPTIONS', 'PUT', 'PATCH', 'DELETE', 'TRACE', 'CONNECT')
 
+    # received bytes to the shared str
+    VERSION_NAMES = {version.encode('latin1'): version for version in VERSIONS}
+    METHOD_NAMES = {method.encode('latin1'): method for method in METHODS}
+
+    # head scanning states
+    REQUEST_LINE, HEADERS = range(2)
+
     def __init__(self, sock, cfg):
         self.sock = sock
         self.cfg = cfg
         self.reader = Reader(sock, cfg.buffer_size)
+        self.reset()
+
+    def reset(self):
+        self.state = self.REQUEST_LINE
+        self.offset = 0
+        self.line_end = 0
+
+    def scan_request_line(self, buff):
+        limit = self.cfg.limit_request_line
+        while True:
+            idx = buff.find(b'\r\n', self.offset)
+            if idx == 0:
+                # ignore empty lines preceding the request line
+                buff.skip(2)
+                self.offset = 0
+                continue
+            # without a CRLF yet, the last byte may be the start of one
+            if idx > limit > 0 or (idx < 0 and len(buff) - 1 > limit > 0):
+                raise LimitRequestLine(limit)
+            if idx < 0:
+                self.offset = max(len(buff) - 1, 0)
+                return False
+            self.line_end = idx
+            self.offset = idx
+            self.state = self.HEADERS
+            return True
 
-    async def parse_headers(self):
+    def scan_headers(self, buff):
+        # the request line CRLF takes part in the search so that an
+        # empty header block is found too
+        limit = self.cfg.limit_request_header
+        idx = buff.find(b'\r\n\r\n', self.offset)
+        # without the end of the block yet, the last three bytes may be
+        # the start of it
+        size = (idx if idx >= 0 else len(buff) - 3) - self.line_end - 2
+        if size > limit > 0:
+            raise LimitRequestHeader(limit)
+        if idx < 0:
+            self.offset = max(len(buff) - 3, self.line_end)
+            return -1
+        return idx
+
+    async def read_head(self):
+        '''
+            Scan for the request line and header block as data arrives, never
+            searching the same bytes twice. Returns a view of the whole head
+            and the length of its request line.
+        '''
+        buff = self.reader.buff
+        while True:
+            if self.state == self.REQUEST_LINE and not self.scan_request_line(buff):
+                await self.reader.read_part()
+                continue
+
+            idx = self.scan_headers(buff)
+            if idx >= 0:
+                break
+            await self.reader.read_part()
+
+        head = buff.consume(idx + 4)
+        line_end = self.line_end
+        self.reset()
+        return head, line_end
+
+    def head_buffered(self):
+        '''Whether a complete request head is already buffered'''
+        buff = self.reader.buff
+        try:
+            if self.state == self.REQUEST_LINE and not self.scan_request_line(buff):
+                return False
+            return self.scan_headers(buff) >= 0
+        except (LimitRequestLine, LimitRequestHeader):
+            # reported when the request is actually parsed
+            return False
+
+    def parse_head(self, head, line_end):
+        lines = bytes(head[:-4]).split(b'\r\n')
+        method, uri, version = self.parse_request_line(lines[0])
+        return method, uri, version, self.parse_headers(lines[1:])
+
+    def parse_headers(self, header_lines):
         headers = []
-        header_lines = await self.read_headers()
-        for field in header_lines.split('\r\n'):
-            parts = field.split(':', 1)
-            if len(parts) != 2:
-                raise InvalidHeader(field.strip())
-            name, value = parts[0].rstrip(), parts[1].lstrip()
-            headers.append((name, value))
+        for field in header_lines:
+            name, sep, value = field.partition(b':')
+            if not sep:
+                raise InvalidHeader(bytes_to_str(field.strip()))
+            name, value = name.rstrip(), value.strip()
+            headers.append((NAMES.get(name) or bytes_to_str(name), VALUES.get(value) or bytes_to_str(value)))
         return headers
         
-    async def parse_request_line(self):
-        request_line = await self.read_request_line()
+    def parse_request_line(self, request_line):
         parts = request_line.split(None, 2)
 
         if len(parts) != 3:
-            raise InvalidRequestLine(request_line)
+            raise InvalidRequestLine(bytes_to_str(request_line))
 
-        method = parts[0].upper()
-        if method not in self.METHODS:
-            raise InvalidRequestMethod(method)
+        method = self.METHOD_NAMES.get(parts[0]) or self.METHOD_NAMES.get(parts[0].upper())
+        if method is None:
+            raise InvalidRequestMethod(bytes_to_str(parts[0]))
 
-        version = parts[2].upper()
-        if version not in self.VERSIONS:
-            raise InvalidHTTPVersion(part[2])
+        version = self.VERSION_NAMES.get(parts[2]) or self.VERSION_NAMES.get(parts[2].upper())
+        if version is None:
+            raise InvalidHTTPVersion(bytes_to_str(parts[2]))
 
-        return method, parts[1], version
+        return method, bytes_to_str(parts[1]), version
 
-    async def read_request_line(self):
-        try:
-            request_line_b = await self.reader.find(b'\r\n', self.cfg.limit_request_line)
-            return bytes_to_str(request_line_b)
-        except OverflowException:
-            raise LimitRequestLine(self.cfg.limit_request_line)
-
-    async def read_headers(self):
-        try:
-            headers_b = await self.reader.find(b'\r\n\r\n', self.cfg.limit_request_header)
-            return bytes_to_str(headers_b)
-        except OverflowException:
-            raise LimitRequestHeader(self.cfg.limit_request_header)
+    async def preread(self):
+        '''Wait for the next request to start arriving'''
+        await self.reader.preread(self.cfg.keepalive_timeout)
 
     async def parse(self):
-        await self.reader.preread(self.cfg.keepalive_timeout)
+        await self.preread()
 
-        method, uri, version = await self.parse_request_line()
+        head, line_end = await self.read_head()
 
-        fields = await self.parse_headers()
+        method, uri, version, fields = self.parse_head(head, line_end)
         header = Header(fields)
 
-        req = Request(method, uri, version, header, self.reader)
-
-        expect = req.header.get('expect') 
-        if expect and expect == '100-continue':
-            await self.sock.sendall(b"HTTP/1.1 100 Continue\r\n\r\n")
+        req = Request(method, uri, version, header, self.reader, self.cfg.limit_request_body)
 
         header = Header()
         header.set('Server', __SERVER_NAME__)
         resp = Response(version, header, req.should_close() if self.cfg.keepalive_timeout else True, self.sock, self.cfg.sendfile)
         return req, resp 
+
+
+class HTTPToolsParser(HTTP_v1_x_Parser):
+    '''
+        Tokenize the request head with the httptools C parser. The head is
+        still delimited by HTTP_v1_x_Parser.read_head, so limits and
+        pipelining behave the same; only the callbacks below run in Python.
+        Heads both parsers accept give the same requests, httptools is
+        stricter about header syntax, such as whitespace before the colon.
+    '''
+
+    def __init__(self, sock, cfg):
+        if httptools is None:
+            raise RuntimeError("httptools is not installed")
+        super().__init__(sock, cfg)
+        self.url = None
+        self.fields = None
+
+    def on_url(self, url):
+        self.url = url if self.url is None else self.url + url
+
+    def on_header(self, name, value):
+        # llhttp keeps the whitespace trailing a value
+        value = value.strip(b' \t')
+        self.fields.append((NAMES.get(name) or bytes_to_str(name), VALUES.get(value) or bytes_to_str(value)))
+
+    def feed_request_line(self, line):
+        parser = httptools.HttpRequestParser(self)
+        parser.feed_data(line)
+        return parser
+
+    def parse_head(self, head, line_end):
+        self.url = None
+        self.fields = []
+        # the request line and the header block are fed apart, so that the
+        # errors of each are told apart
+        try:
+            parser = self.feed_request_line(head[:line_end + 2])
+        except httptools.HttpParserError:
+            # httptools only takes the method and version in upper case,
+            # retry as HTTP_v1_x_Parser reads them
+            request_line = bytes(head[:line_end])
+            method, _, version = self.parse_request_line(request_line)
+            uri = request_line.split(None, 2)[1]
+            self.url = None
+            try:
+                parser = self.feed_request_line(b' '.join((method.encode('latin1'), uri, version.encode('latin1'))) + b'\r\n')
+            except httptools.HttpParserError:
+                raise InvalidRequestLine(bytes_to_str(request_line))
+
+        try:
+            parser.feed_data(head[line_end + 2:])
+        except httptools.HttpParserUpgrade:
+            # the parser stops after the head of Upgrade and CONNECT
+            # requests, which are left to the application
+            pass
+        except httptools.HttpParserError as e:
+            raise InvalidHeader(str(e))
+
+        method = self.METHOD_NAMES.get(parser.get_method())
+        if method is None:
+            raise InvalidRequestMethod(bytes_to_str(parser.get_method()))
+
+        version = self.VERSION_NAMES.get(b'HTTP/' + parser.get_http_version().encode('latin1'))
+        if version is None:
+            raise InvalidHTTPVersion('HTTP/' + parser.get_http_version())
+
+        return method, bytes_to_str(self.url), version, self.fields
+
+
+PARSERS = {
+        'python': HTTP_v1_x_Parser,
+        'httptools': HTTPToolsParser,
+        }
+
+def parser_class(name):
+    '''Resolve the `parser` setting to a parser class'''
+    if name == 'auto':
+        return HTTP_v1_x_Parser if httptools is None else HTTPToolsParser
+    if name in PARSERS:
+        return PARSERS[name]
+    return load_symbol(name)
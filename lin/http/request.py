@@ -1,74 +1,145 @@
 # -*- coding: utf-8 -*-
 
-import sys
 import time
 
-from io import BytesIO
-
-from lin.http.excepts import InvalidChunk, InvalidHeader
+from lin.utils import bytes_to_str
+from lin.http.excepts import (
+        InvalidChunk, InvalidHeader, LimitRequestHeader, LimitRequestBody, OverflowException
+        )
 from lin.http.header import Header
 
 
 class IReader:
-    def read(self, size):
+    '''
+        Asynchronous request body. `await body.read(n)` returns at most n
+        bytes (b'' at the end of the body), `await body.read()` returns the
+        rest of it, and `async for part in body` yields it part by part.
+    '''
+
+    async def read_some(self, size):
         raise NotImplementedError()
 
+    async def read(self, size=-1):
+        if size is None or size < 0:
+            return await self.readall()
+        return await self.read_some(size) if size else b''
+
+    async def readall(self):
+        parts = []
+        async for part in self:
+            parts.append(part)
+        return b''.join(parts)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        data = await self.read_some(self.reader.buffer_size)
+        if not data:
+            raise StopAsyncIteration()
+        return data
+
 class ChunkReader(IReader):
-    def __init__(self, reader):
-        self.reader = reader
-        self.remain_size = None
+    '''
+        Decode a chunked body straight out of the connection's receive
+        buffer. Chunk extensions of the last chunk are kept in `extensions`
+        and the trailer fields in `trailers`.
+    '''
 
-    def read_chunk(self):
-        chunk_size = self.read_chunk_size()
+    HEXDIGITS = frozenset(b'0123456789abcdefABCDEF')
 
-        data = self.reader.read(chunk_size + 2)
-        return data[:-2]
-        
-    def read_chunk_size(self):
-        size = self.reader.read_line()
-        try:
-            return int(size[:-2], 16)
-        except ValueError:
-            raise InvalidChunk(size)
+    LIMIT_CHUNK_LINE = 4096
+    LIMIT_TRAILER = 8192
 
-    def read_remain_chunk(self):
-        data = self.reader.read(self.remain_size + 2)
-        return data[:-2]
-        
-    def read(self, size):
-        if size == 0 or self.remain_size == 0:
-            return b''
+    def __init__(self, reader, limit=0):
+        self.reader = reader
+        self.limit = limit
+        self.received = 0
+        self.remain_size = 0
+        self.pending_crlf = False
+        self.extensions = []
+        self.trailers = Header()
+        self.eof = False
 
-        # initialize the chunk size
-        if self.remain_size is None:
-            self.remain_size = self.read_chunk_size()
-            if self.remain_size == 0:
-                self.read_remain_chunk()
-                return b''
+    def parse_chunk_line(self, line):
+        size, _, extensions = line.partition(b';')
+        size = size.rstrip(b' \t')
+        if not size or not self.HEXDIGITS.issuperset(size):
+            raise InvalidChunk(line)
 
-        buff = BytesIO()
+        self.extensions = []
+        for extension in extensions.split(b';') if extensions else ():
+            name, _, value = extension.partition(b'=')
+            self.extensions.append((bytes_to_str(name.strip()), bytes_to_str(value.strip().strip(b'"'))))
+        return int(size, 16)
 
+    async def read_crlf(self):
+        try:
+            line = await self.reader.read_line(2)
+        except OverflowException:
+            line = None
+        if line != b'':
+            raise InvalidChunk("missing CRLF after chunk data")
+
+    async def read_trailer(self):
+        remain = self.LIMIT_TRAILER
         while True:
-            pre_size = len(buff.getvalue())
-            known_size = pre_size + self.remain_size
-
-            if size >= known_size:
-                data = self.read_remain_chunk()
-                buff.write(data)
-                self.remain_size = self.read_chunk_size()
-
-                if self.remain_size == 0:
-                    self.read_remain_chunk()
-                    return buff.getvalue()
-                elif size == known_size:
-                    return buff.getvalue()
-                else:
-                    continue
-            else:
-                data = self.reader.read(size - pre_size)
-                buff.write(data)
-                self.remain_size = known_size - size
-                return buff.getvalue()
+            if remain <= 0:
+                raise LimitRequestHeader(self.LIMIT_TRAILER)
+            try:
+                line = await self.reader.read_line(remain)
+            except OverflowException:
+                raise LimitRequestHeader(self.LIMIT_TRAILER)
+            if not line:
+                return
+            remain -= len(line) + 2
+            name, sep, value = bytes_to_str(line).partition(':')
+            if not sep:
+                raise InvalidHeader(line)
+            self.trailers.add(name.rstrip(), value.strip())
+
+    async def next_chunk(self):
+        if self.pending_crlf:
+            await self.read_crlf()
+            self.pending_crlf = False
+
+        try:
+            line = await self.reader.read_line(self.LIMIT_CHUNK_LINE)
+        except OverflowException:
+            raise InvalidChunk("chunk line too long")
+
+        self.remain_size = self.parse_chunk_line(line)
+        self.received += self.remain_size
+        if self.received > self.limit > 0:
+            raise LimitRequestBody(self.limit)
+        if self.remain_size == 0:
+            await self.read_trailer()
+            self.eof = True
+
+    def next_chunk_buffered(self):
+        return self.reader.buff.find(b'\r\n', 2 if self.pending_crlf else 0) >= 0
+
+    async def read_some(self, size):
+        # decode as many chunks as are already buffered, only waiting on
+        # the socket until some data is available
+        parts = []
+        while size > 0 and not self.eof:
+            if not self.remain_size:
+                if parts and not self.next_chunk_buffered():
+                    break
+                await self.next_chunk()
+                continue
+
+            if parts and not self.reader.buff:
+                break
+
+            data = await self.reader.read(min(size, self.remain_size))
+            self.remain_size -= len(data)
+            self.pending_crlf = not self.remain_size
+            size -= len(data)
+            parts.append(data)
+
+        return parts[0] if len(parts) == 1 else b''.join(parts)
 
 
 class LengthReader(IReader):
@@ -76,35 +147,25 @@ class LengthReader(IReader):
         self.length = length
         self.reader = reader
 
-    def read(self, size):
-        length = min(self.length, size)
-        if length == 0:
-            return b''
-        else:
-            data = self.reader.read(length)
-            self.length -= length
-            return data
-
-class EOFReader(IReader):
-    def __init__(self, reader):
-        self.reader = reader
-        self.eof = False
+    @property
+    def eof(self):
+        return self.length == 0
 
-    def read(self, size):
-        if self.eof or size == 0:
+    async def read_some(self, size):
+        size = min(self.length, size)
+        if size == 0:
             return b''
-        else:
-            data = self.reader.read(size, 1)
-            if len(data) < size:
-                self.eof = True
-            return data
-                
+        data = await self.reader.read(size)
+        self.length -= len(data)
+        return data
+
 class Request:
-    def __init__(self, method, uri, version, header, reader):
+    def __init__(self, method, uri, version, header, reader, limit_body=0):
         self.method = method
         self.uri = uri
         self.version = version
         self.reader = reader
+        self.limit_body = limit_body
         self._header = header 
         self._body = None
         self.initial_time = time.time()
@@ -114,6 +175,10 @@ class Request:
     def local_addr(self):
         return self.reader.sock.local_addr
 
+    @property
+    def remote_addr(self):
+        return self.reader.sock.remote_addr
+
     @property
     def header(self):
         return self._header
@@ -140,19 +205,28 @@ class Request:
         if content_length and content_length < 0:
             raise InvalidHeader("Content-Length")
 
-        chunked = self.header.get("Transfer-Encoding") == 'chunked'
-        if chunked:
-            self.body = ChunkReader(self.reader)
-        elif content_length:
-            self.body = LengthReader(self.reader, content_length)
+        if content_length and content_length > self.limit_body > 0:
+            raise LimitRequestBody(self.limit_body)
+
+        if self.chunked:
+            self.body = ChunkReader(self.reader, self.limit_body)
         else:
-            self.body = EOFReader(self.reader)
+            # a request without a length has no body (RFC 7230 3.3.3), the
+            # bytes that follow belong to the next request
+            self.body = LengthReader(self.reader, content_length or 0)
 
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         self._body = None
 
+    @property
+    def chunked(self):
+        return self.header.get("Transfer-Encoding") == 'chunked'
+
+    def has_body(self):
+        return self.chunked or bool(self.header.get("Content-Length", int))
+
     def should_close(self):
         value = self.header.get('Connection')
         if value == 'close':
@@ -1,9 +1,12 @@
 # -*- coding: utf-8 -*-
 
 import os
+import threading
 import collections
+import collections.abc
 
-from lin.utils import bytes_to_str, str_to_bytes, http_date
+from lin.clock import clock
+from lin.utils import bytes_to_str, str_to_bytes
 from lin.http.header import Header
 
 
@@ -28,6 +31,9 @@ class File(metaclass=MetaFile):
 
 class IWriter:
 
+    # whether the body is iterated with async for
+    asynchronous = False
+
     def write(self, data):
         raise NotImplementedError()
 
@@ -37,6 +43,9 @@ class IWriter:
     def close(self):
         raise NotImplementedError()
 
+    async def aclose(self):
+        self.close()
+
 
 class Writer(IWriter):
     def __init__(self, write):
@@ -46,13 +55,26 @@ class Writer(IWriter):
     def write(self, data):
         self._write(data)
 
+    @property
+    def asynchronous(self):
+        return isinstance(self._raw, collections.abc.AsyncIterable)
+
     def __iter__(self):
         yield from self._raw
 
+    def __aiter__(self):
+        return self._raw.__aiter__()
+
     def close(self):
         if hasattr(self._raw, 'close'):
             self._raw.close()
 
+    async def aclose(self):
+        if hasattr(self._raw, 'aclose'):
+            await self._raw.aclose()
+        else:
+            self.close()
+
     def __call__(self, raw):
         if not self._raw is None:
             raise AssertionError("body has been initialized")
@@ -60,12 +82,83 @@ class Writer(IWriter):
         if isinstance(raw, File):
             File.bind(raw, self)
             self._raw = raw
-        elif isinstance(raw, collections.Iterable):
+        elif isinstance(raw, (collections.abc.Iterable, collections.abc.AsyncIterable)):
             self._raw = raw
         else:
             raise TypeError("'raw' object is not iterable or file")
 
+class WriteBridge:
+    '''
+        The write() callable for applications running in a thread. Data is
+        handed to the event loop, which writes it in order through the
+        response; the calling thread only blocks while more than `limit`
+        bytes are waiting to be queued on the connection.
+    '''
+
+    def __init__(self, response, loop, limit):
+        self.response = response
+        self.loop = loop
+        self.limit = limit
+        self.cond = threading.Condition()
+        self.pending = 0
+        self.queue = collections.deque()
+        self.task = None
+        self.error = None
+        # responses are created on the loop thread
+        self.loop_thread = threading.get_ident()
+
+    def __call__(self, data):
+        # only the loop drains the bridge, it queues without waiting
+        on_loop = threading.get_ident() == self.loop_thread
+        with self.cond:
+            if not on_loop:
+                self.cond.wait_for(lambda: self.pending <= self.limit or self.error)
+            if self.error:
+                raise self.error
+            self.pending += len(data)
+        if on_loop:
+            self.put(data)
+        else:
+            self.loop.call_soon_threadsafe(self.put, data)
+
+    def put(self, data):
+        self.queue.append(data)
+        if self.task is None:
+            self.task = self.loop.create_task(self.run())
+
+    async def run(self):
+        error = ConnectionAbortedError('Response writing cancelled')
+        try:
+            while self.queue:
+                data = self.queue.popleft()
+                await self.response.write(data)
+                with self.cond:
+                    self.pending -= len(data)
+                    self.cond.notify_all()
+            error = None
+        except Exception as e:
+            error = e
+        finally:
+            self.task = None
+            # also on cancellation, a writer waiting for room must wake up
+            if error is not None:
+                with self.cond:
+                    self.error = error
+                    self.cond.notify_all()
+
+    async def join(self):
+        '''Wait until everything written so far is queued on the connection'''
+        if self.task is not None:
+            await self.task
+        if self.error:
+            raise self.error
+
 class Response:
+
+    # encoded status lines by (version, status), shared by all responses
+    STATUS_LINES = {}
+    STATUS_LINES_LIMIT = 256
+
     def __init__(self, version, header, should_close, writer, sendfile):
         self.version = version
         self._header = header
@@ -87,7 +180,8 @@ class Response:
         self._header = header
 
     def __enter__(self):
-        self._body = Writer(self.blocking_write)
+        self.bridge = WriteBridge(self, self.writer.loop, self.writer.high_water)
+        self._body = Writer(self.bridge)
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
@@ -125,62 +219,78 @@ class Response:
         if self.status is None:
             raise AssertionError("response status not set")
 
-        status_line = "{} {}\r\n".format(self.version, self.status)
-        self.header.set('Date', http_date())
+        status_line = self.STATUS_LINES.get((self.version, self.status))
+        if status_line is None:
+            status_line = str_to_bytes("{} {}\r\n".format(self.version, self.status))
+            if len(self.STATUS_LINES) < self.STATUS_LINES_LIMIT:
+                self.STATUS_LINES[(self.version, self.status)] = status_line
+
         self.header.set('Connection', 'close' if self.should_close or self.status_code != 200 else 'keep-alive')
         header_bytes = self.header.to_bytes()
-        return str_to_bytes(status_line) + header_bytes
-
-    def blocking_write(self, data):
-        self.blocking_send_header()
-        if self.is_chunked():
-            data = self.to_chunk(data)
-        self.writer.blocking_write(data)
+        if 'Date' in self.header:
+            return status_line + header_bytes
+        return status_line + clock.date_field + header_bytes
 
-    def blocking_send_header(self):
-        if not self.header_sent:
-            self.writer.blocking_write(self.header_to_bytes())
-            self.header_sent = True
-
-    @classmethod
-    def to_chunk(cls, data):
-        size = b"%X\r\n" % len(data)
-        return b''.join([size + data + b'\r\n'])
+    async def write(self, data):
+        await self.send_header()
+        await self._send_data(data, self.chunked)
 
     async def send_header(self):
         if not self.header_sent:
-            await self.writer.sendall(self.header_to_bytes())
+            self.writer.write(self.header_to_bytes())
             self.header_sent = True
 
     async def _send_file(self, fd, offset, nbytes, chunked=False):
         if chunked:
-            await self.writer.sendall(b"%X\r\n" % nbytes)
+            self.writer.write(b"%X\r\n" % nbytes)
 
+        # queued data must go out ahead of the file
+        await self.writer.drain()
         await self.writer.sendfile(fd, offset, nbytes)
 
         if chunked:
-            await self.writer.sendall(b"\r\n")
+            self.writer.write(b"\r\n")
 
     async def _send_data(self, data, chunked=False):
-        if chunked:
-            await self.writer.sendall(self.to_chunk(data))
-        else:
-            await self.writer.sendall(data)
+        if not data:
+            # an empty chunk would terminate the body
+            return
 
-    async def flush(self):
-        await self.send_header()
-
-        if self.sendfile and isinstance(self.body, File) and File.size(self.body) > 0:
-            offset = File.offset(self.body)
-            filesize = File.size(self.body)
-
-            count = filesize - offset if self.chunked else self.header.get('Content-Length', int)
-            await self._send_file(self.body, offset, count, self.chunked)
+        if chunked:
+            # framing goes out as separate buffers of the same write
+            self.writer.write(b"%X\r\n" % len(data))
+            self.writer.write(data)
+            self.writer.write(b"\r\n")
         else:
-            for part in self.body:
-                await self._send_data(part, self.chunked)
+            self.writer.write(data)
 
-        if self.chunked:
-            await self._send_data(b'', self.chunked)
+        if self.writer.needs_drain():
+            await self.writer.drain(self.writer.low_water)
 
-        self.body.close()
+    async def flush(self):
+        '''
+            Queue the response on the connection. Small responses are left in
+            the connection's write buffer for the caller to drain, so that
+            pipelined responses go out together.
+        '''
+        try:
+            await self.bridge.join()
+            await self.send_header()
+
+            if self.sendfile and isinstance(self.body, File) and File.size(self.body) > 0:
+                offset = File.offset(self.body)
+                filesize = File.size(self.body)
+
+                count = filesize - offset if self.chunked else self.header.get('Content-Length', int)
+                await self._send_file(self.body, offset, count, self.chunked)
+            elif self.body.asynchronous:
+                async for part in self.body:
+                    await self._send_data(part, self.chunked)
+            else:
+                for part in self.body:
+                    await self._send_data(part, self.chunked)
+
+            if self.chunked:
+                self.writer.write(b'0\r\n\r\n')
+        finally:
+            await self.body.aclose()
@@ -7,24 +7,60 @@ import signal
 import asyncio
 import logging
 import functools
+import importlib.util
 
 from lin.accepter import Accepter
+from lin.clock import clock
 from lin.worker import Worker
 
 logger = logging.getLogger(__name__)
 
+def new_event_loop(name):
+    if name == 'uvloop' or (name == 'auto' and importlib.util.find_spec('uvloop') is not None):
+        import uvloop
+        return uvloop.new_event_loop()
+    return asyncio.new_event_loop()
+
 class Manager:
 
     BOOT_ERROR = 128
 
-    def __init__(self, connectors, config):
+    def __init__(self, connectors, config, ready=None):
         self.connectors = connectors
         self.config = config
-        self.loop = asyncio.get_event_loop()
+        self.ready = ready
+        self.loop = self.new_loop()
         self.setup()
 
+    def new_loop(self):
+        '''create the loop of this manager with the configured implementation'''
+        loop = new_event_loop(self.config.event_loop)
+        asyncio.set_event_loop(loop)
+        return loop
+
     def setup(self):
-        self.accepter = Accepter(self.connectors, Worker(self.config), self.config.connections, self.loop)
+        if self.config.reuse_port:
+            self.connectors = self.reuse_port(self.connectors)
+        clock.start(self.loop)
+        self.worker = Worker(self.config)
+        self.accepter = Accepter(self.connectors, self.worker, self.config.connections, self.loop,
+                self.config.engine, self.config.accept_batch)
+        self.exitcode = self.BOOT_ERROR
+        self.draining = False
+
+    def reuse_port(self, connectors):
+        '''listen on sockets of this manager, the kernel balances connections across them'''
+        duplicates = [connector.duplicate() for connector in connectors]
+        for connector in connectors:
+            connector.close()
+        return duplicates
+
+    def notify_ready(self):
+        '''tell the arbiter this manager accepts connections'''
+        if self.ready is not None:
+            os.write(self.ready, b'.')
+            os.close(self.ready)
+            self.ready = None
 
     @property
     def pid(self):
@@ -36,12 +72,25 @@ class Manager:
 
     def reload(self):
         '''reload config'''
-        #TODO
-        pass
+        # a manager keeps the config it was forked with, the arbiter reloads
+        # by replacing the managers
+        logger.info("Manager ignoring reload with pid: {}, send SIGHUP to the arbiter".format(self.pid))
+
+    async def drain(self):
+        '''stop accepting, then let the requests in progress finish'''
+        logger.info("Manager draining with pid: {}".format(self.pid))
+        self.accepter.exit()
+        dropped = await self.worker.shutdown(self.config.graceful_timeout)
+        if dropped:
+            logger.warning("Closed {} busy connections after graceful timeout".format(dropped))
+        self.exitcode = 0
+        self.loop.stop()
 
     def sigquit_handler(self):
         '''graceful shutdown'''
-        self.exit(1)
+        if not self.draining:
+            self.draining = True
+            self.loop.create_task(self.drain())
 
     def sigint_handler(self):
         '''quick shutdown'''
@@ -64,10 +113,12 @@ class Manager:
     def run(self):
         logger.info("Manager booting with pid: {}".format(self.pid))
         self.init_signals()
+        # called once the loop runs, the connectors are listening by then
+        self.loop.call_soon(self.notify_ready)
         self.accepter.run()
 
         logger.info("Manager exiting with pid: {}".format(self.pid))
-        self.exit(self.BOOT_ERROR)
+        self.exit(self.exitcode)
 
     def __str__(self):
         return "<Manager {}>".format(self.pid)
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+
+import os
+import asyncio
+
+
+class ProtocolSocket(asyncio.BufferedProtocol):
+    '''
+        A connection served by an event loop transport, with the interface
+        of AsyncSocketWrapper.
+
+        The socket stays registered with the loop for the whole connection
+        instead of once per call. A pending `recv_into` hands its buffer to
+        the transport (see `get_buffer`), so data is received straight into
+        the parser's buffer; data arriving while no read is pending is kept
+        and copied out by the next one.
+    '''
+
+    # bytes kept while no read is pending, reading pauses when it is full
+    STASH_SIZE = 65536
+
+    def __init__(self, loop):
+        self._loop = loop
+        self._transport = None
+        self._target = None
+        self._waiter = None
+        self._stash = bytearray(self.STASH_SIZE)
+        self._stash_size = 0
+        self._reading_paused = False
+        self._writing_paused = False
+        self._drain_waiter = None
+        self._eof = False
+        self._lost = False
+        self._exc = None
+        self._wbuf = []
+        self._wbuf_size = 0
+        self.set_write_buffer_limits()
+
+    @classmethod
+    async def accepted(cls, loop, sock):
+        '''Serve an accepted socket with a transport'''
+        transport, protocol = await loop.connect_accepted_socket(lambda: cls(loop), sock)
+        return protocol
+
+    # protocol callbacks
+
+    def connection_made(self, transport):
+        self._transport = transport
+        transport.set_write_buffer_limits(self.high_water, self.low_water)
+
+    def get_buffer(self, sizehint):
+        if self._target is not None:
+            return self._target
+        return memoryview(self._stash)[self._stash_size:]
+
+    def buffer_updated(self, nbytes):
+        if self._target is not None:
+            self._target = None
+            self._wake(self._waiter, nbytes)
+            return
+
+        self._stash_size += nbytes
+        if self._stash_size >= len(self._stash):
+            self._transport.pause_reading()
+            self._reading_paused = True
+
+    def eof_received(self):
+        self._eof = True
+        self._wake(self._waiter, 0)
+        # keep the transport open for the response still being written
+        return True
+
+    def connection_lost(self, exc):
+        self._eof = True
+        self._lost = True
+        self._exc = exc
+        self._wake(self._waiter, 0, exc)
+        self._wake(self._drain_waiter, None, exc or ConnectionResetError('Connection lost'))
+
+    def pause_writing(self):
+        self._writing_paused = True
+
+    def resume_writing(self):
+        self._writing_paused = False
+        self._wake(self._drain_waiter, None)
+
+    def _wake(self, waiter, result, exc=None):
+        if waiter is None or waiter.done():
+            return
+        if exc is not None:
+            waiter.set_exception(exc)
+        else:
+            waiter.set_result(result)
+
+    # AsyncSocketWrapper interface
+
+    def set_write_buffer_limits(self, high=65536, low=16384):
+        self.high_water = high
+        self.low_water = min(low, high)
+        if self._transport is not None:
+            self._transport.set_write_buffer_limits(self.high_water, self.low_water)
+
+    @property
+    def loop(self):
+        return self._loop
+
+    @property
+    def buffered(self):
+        return self._wbuf_size + self._transport.get_write_buffer_size()
+
+    @property
+    def local_addr(self):
+        return self._transport.get_extra_info('sockname')
+
+    @property
+    def remote_addr(self):
+        return self._transport.get_extra_info('peername')
+
+    def close(self):
+        self._transport.close()
+
+    def shutdown(self):
+        self._transport.abort()
+
+    def write_eof(self):
+        '''Close the sending side after the data the transport holds'''
+        self._transport.write_eof()
+
+    async def recv_timeout(self, nbytes, timeout):
+        return await asyncio.wait_for(self.recv(nbytes), timeout=timeout) if timeout else await self.recv(nbytes)
+
+    async def recv_into_timeout(self, buf, timeout):
+        return await asyncio.wait_for(self.recv_into(buf), timeout=timeout) if timeout else await self.recv_into(buf)
+
+    async def recv(self, nbytes):
+        # no more than a stash worth, a read returns what one transport
+        # callback delivers anyway
+        buf = bytearray(min(nbytes, self.STASH_SIZE))
+        size = await self.recv_into(buf)
+        del buf[size:]
+        return bytes(buf)
+
+    async def recv_into(self, buf):
+        if self._stash_size:
+            size = min(len(buf), self._stash_size)
+            buf[:size] = self._stash[:size]
+            self._stash[:self._stash_size - size] = self._stash[size:self._stash_size]
+            self._stash_size -= size
+            if self._reading_paused:
+                self._reading_paused = False
+                self._transport.resume_reading()
+            return size
+
+        if self._exc is not None:
+            raise self._exc
+        if self._eof or not len(buf):
+            return 0
+
+        self._target = buf
+        self._waiter = self._loop.create_future()
+        try:
+            return await self._waiter
+        finally:
+            self._target = None
+            self._waiter = None
+
+    async def sendall(self, data):
+        self.write(data)
+        await self.drain()
+
+    def write(self, data):
+        '''Queue data to be sent by the next drain'''
+        self._wbuf.append(data)
+        self._wbuf_size += len(data)
+
+    async def drain(self, limit=0):
+        '''
+            Hand queued data to the transport, and pause the caller while the
+            transport holds more than its high water mark and more than
+            `limit` bytes.
+        '''
+        if self._lost:
+            raise self._exc or ConnectionResetError('Connection lost')
+
+        if self._wbuf:
+            self._transport.writelines(self._wbuf)
+            self._wbuf = []
+            self._wbuf_size = 0
+
+        while self._writing_paused and self._transport.get_write_buffer_size() > limit:
+            self._drain_waiter = self._loop.create_future()
+            try:
+                await self._drain_waiter
+            finally:
+                self._drain_waiter = None
+
+    def needs_drain(self):
+        return self._wbuf_size >= self.high_water
+
+    async def sendfile(self, file, offset=0, count=None, *, fallback=True):
+        try:
+            return await self._loop.sendfile(self._transport, file, offset, count, fallback=fallback)
+        except NotImplementedError:
+            # loops such as uvloop have no sendfile, the file is read in the
+            # default executor and written through the transport
+            return await self._sendfile(file, offset, count)
+
+    async def _sendfile(self, file, offset, count):
+        fileno = file.fileno()
+        total = 0
+        try:
+            while count is None or total < count:
+                blocksize = self.STASH_SIZE if count is None else min(count - total, self.STASH_SIZE)
+                data = await self._loop.run_in_executor(None, os.pread, fileno, blocksize, offset + total)
+                if not data:
+                    break
+                total += len(data)
+                self.write(data)
+                await self.drain()
+        finally:
+            os.lseek(fileno, offset + total, os.SEEK_SET)
+        return total
@@ -1,53 +1,57 @@
 # -*- coding: utf-8 -*-
 
+import os
 import asyncio
 import io
-import socket, select, errno
+import socket, errno
+
+try:
+    IOV_MAX = os.sysconf('SC_IOV_MAX')
+except (AttributeError, ValueError, OSError):
+    IOV_MAX = 1024
+
+SENDFILE_BLOCKSIZE = 2 ** 30
 
 class AsyncSocketWrapper:
+
     def __init__(self, loop, sock):
         self._loop = loop
         self._sock = sock
+        self._wbuf = []
+        self._wbuf_size = 0
+        self._local_addr = None
+        self._remote_addr = None
+        self.set_write_buffer_limits()
+
+    def set_write_buffer_limits(self, high=65536, low=16384):
+        '''
+            Queued bytes at which writers should drain (high) and down to
+            which a drain waits on a full socket (low). A high of 0 sends
+            every write right away.
+        '''
+        self.high_water = high
+        self.low_water = min(low, high)
 
     @property
-    def local_addr(self):
-        return self._sock.getsockname()
+    def loop(self):
+        return self._loop
 
     @property
-    def remote_addr(self):
-        return self._sock.getpeername()
+    def buffered(self):
+        return self._wbuf_size
 
-    def blocking_write(self, data):
-        length = len(data)
-        while length:
-            try:
-                sent = self._sock.send(data)
-            except BlockingIOError as e:
-                select.select([], [self._sock], [])
-                continue
-            data = data[sent:]
-            length -= sent
-
-    def blocking_read(self, size, timeout=None):
-        data = b''
-        while True:
-            try:
-                part = self._sock.recv(size)
-                if len(part) == 0:
-                    return data
-                elif len(part) < size:
-                    data += part
-                    size -= len(part)
-                    continue
-                else:
-                    return data + part
+    @property
+    def local_addr(self):
+        # the addresses of a connection never change, ask the kernel once
+        if self._local_addr is None:
+            self._local_addr = self._sock.getsockname()
+        return self._local_addr
 
-            except BlockingIOError as e:
-                rlist, _, _ = select.select([self._sock], [], [], timeout)
-                if rlist:
-                    continue
-                else:
-                    return data
+    @property
+    def remote_addr(self):
+        if self._remote_addr is None:
+            self._remote_addr = self._sock.getpeername()
+        return self._remote_addr
 
     def close(self):
         self._loop.remove_reader(self._sock.fileno())
@@ -56,9 +60,16 @@ class AsyncSocketWrapper:
     def shutdown(self):
         self._sock.shutdown(socket.SHUT_RDWR)
 
+    def write_eof(self):
+        '''Close the sending side, once the queued data is drained'''
+        self._sock.shutdown(socket.SHUT_WR)
+
     async def recv_timeout(self, nbytes, timeout):
         return await asyncio.wait_for(self.recv(nbytes), timeout=timeout) if timeout else await self.recv(nbytes)
 
+    async def recv_into_timeout(self, buf, timeout):
+        return await asyncio.wait_for(self.recv_into(buf), timeout=timeout) if timeout else await self.recv_into(buf)
+
     async def recv(self, nbytes):
         return await self._loop.sock_recv(self._sock, nbytes)
 
@@ -68,6 +79,50 @@ class AsyncSocketWrapper:
     async def sendall(self, data):
         return await self._loop.sock_sendall(self._sock, data)
 
+    def write(self, data):
+        '''Queue data to be sent by the next drain'''
+        self._wbuf.append(data)
+        self._wbuf_size += len(data)
+
+    async def drain(self, limit=0):
+        '''
+            Send queued data with scatter/gather writes. While the socket is
+            full the caller is paused until no more than `limit` bytes remain
+            queued, the rest is sent by a later drain.
+        '''
+        while self._wbuf:
+            try:
+                sent = self._sock.sendmsg(self._wbuf[:IOV_MAX])
+            except (BlockingIOError, InterruptedError):
+                if self._wbuf_size <= limit:
+                    return
+                await self.writable()
+                continue
+
+            self._wbuf_size -= sent
+
+            # drop the buffers sent in full and trim a partially sent one
+            buffers = self._wbuf
+            idx = 0
+            while idx < len(buffers) and sent >= len(buffers[idx]):
+                sent -= len(buffers[idx])
+                idx += 1
+            del buffers[:idx]
+            if sent:
+                buffers[0] = memoryview(buffers[0])[sent:]
+
+    def needs_drain(self):
+        return self._wbuf_size >= self.high_water
+
+    async def writable(self):
+        fd = self._sock.fileno()
+        waiter = self._loop.create_future()
+        self._loop.add_writer(fd, lambda: waiter.done() or waiter.set_result(None))
+        try:
+            await waiter
+        finally:
+            self._loop.remove_writer(fd)
+
     async def connect(self, address):
         return await self._loop.sock_connect(self._sock, address)
 
@@ -76,4 +131,28 @@ class AsyncSocketWrapper:
         return AsyncSocketWrapper(self._loop, sock), address
 
     async def sendfile(self, file, offset=0, count=None, *, fallback=True):
-        return await self._loop.sock_sendfile(self._sock, file, offset, count, fallback=fallback)
+        try:
+            return await self._loop.sock_sendfile(self._sock, file, offset, count, fallback=fallback)
+        except NotImplementedError:
+            # loops such as uvloop have no sock_sendfile
+            return await self._sendfile(file, offset, count)
+
+    async def _sendfile(self, file, offset, count):
+        fd = self._sock.fileno()
+        fileno = file.fileno()
+        total = 0
+        try:
+            while count is None or total < count:
+                blocksize = SENDFILE_BLOCKSIZE if count is None else min(count - total, SENDFILE_BLOCKSIZE)
+                try:
+                    sent = os.sendfile(fd, fileno, offset + total, blocksize)
+                except (BlockingIOError, InterruptedError):
+                    await self.writable()
+                    continue
+                if sent == 0:
+                    break
+                total += sent
+        finally:
+            # the file position ends after the data sent, as with sock_sendfile
+            os.lseek(fileno, offset + total, os.SEEK_SET)
+        return total
@@ -77,6 +77,25 @@ class LazyFunction:
         if self._instance is None:
             self._instance = self.func(**self.kwargs)
         return self._instance(*args, **kwargs)
+
+    def preload(self):
+        """Run the `preload` hook of the class, if any, without creating the instance"""
+        for value in self.kwargs.values():
+            preload(value)
+        hook = getattr(self.func, 'preload', None)
+        if hook is not None:
+            hook(**self.kwargs)
+
+def preload(value):
+    """Preload the injected objects found in value"""
+    if isinstance(value, LazyFunction):
+        value.preload()
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            preload(item)
+    elif isinstance(value, dict):
+        for item in value.values():
+            preload(item)
     
 def load_symbol(symbol):
     sep = ':' if ':' in symbol else '.'
@@ -10,20 +10,36 @@ from lin.version import __SERVER_NAME__
 from lin.http.header import Header
 from lin.http.response import Response
 
-from lin.http.parser import HTTP_v1_x_Parser as HTTParser
+from lin.http.parser import parser_class
 from lin.http.handlers.wsgihandler import WSGIHandler
 from lin.http.excepts import ( 
-        NoMoreData, LimitRequestLine, LimitRequestHeader,
-        InvalidRequestMethod, InvalidHeader
+        NoMoreData, LimitRequestLine, LimitRequestHeader, LimitRequestBody,
+        InvalidRequestLine, InvalidRequestMethod, InvalidHTTPVersion, InvalidHeader,
+        InvalidChunk
         )
 
 logger = logging.getLogger(__name__)
 
 class Worker:
+
+    # request body bytes left unread by a handler that are read off to
+    # keep the connection, larger leftovers close it
+    DISCARD_LIMIT = 65536
+
+    # seconds unread request data is read off for after a half close
+    LINGER_TIME = 2
+
+    # seconds a drain lets requests already received on idle connections
+    # start, before closing those still idle
+    IDLE_GRACE = 0.1
+
     def __init__(self, conf):
         self.conf = conf
-        self.parser_cls = HTTParser
+        self.parser_cls = parser_class(conf.parser)
         self.handler = conf.handler
+        # connection tasks, and whether each is busy with a request
+        self.connections = {}
+        self.draining = False
 
     async def handle_except(self, writer, status_code, reason):
         TEMPLATE = '''<html>
@@ -44,15 +60,83 @@ class Worker:
         with resp:
             resp.body([content])
             await resp.flush()
+        await writer.drain()
+
+    async def handle(self, client, req, resp):
+        '''Returns whether the connection closes with request body left unread'''
+        with req, resp:
+            if req.header.get('Expect') == '100-continue':
+                # pipelined responses queued so far must precede it
+                client.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+                await client.drain()
+            await self.handler.handle(req, resp)
+            if self.draining:
+                resp.should_close = True
+            body = req.body
+            # a chunked or long body left unread closes the connection,
+            # decided before the response says otherwise
+            if not body.eof and (req.chunked or body.length > self.DISCARD_LIMIT):
+                resp.should_close = True
+            await resp.flush()
+            if body.eof:
+                return False
+            if resp.should_close:
+                return True
+            await self.discard(client, body)
+            return False
+
+    async def discard(self, client, body):
+        '''Read off the body the handler left, so that the next request starts where it ends'''
+        # the client may wait for the response before sending the rest
+        await client.drain()
+        while not body.eof:
+            await asyncio.wait_for(body.read_some(self.DISCARD_LIMIT), self.conf.keepalive_timeout or None)
+
+    async def linger(self, client):
+        '''
+            Half close a connection with request data left unread, and read
+            it off for up to LINGER_TIME seconds. Closing with data unread
+            resets the connection, which can drop the response sent.
+        '''
+        try:
+            client.write_eof()
+            deadline = client.loop.time() + self.LINGER_TIME
+            while True:
+                remaining = deadline - client.loop.time()
+                if remaining <= 0 or not await client.recv_timeout(65536, remaining):
+                    break
+        except (socket.error, asyncio.TimeoutError):
+            pass
 
     async def process(self, client):
+        client.set_write_buffer_limits(self.conf.write_buffer_high, self.conf.write_buffer_low)
         parser = self.parser_cls(client, self.conf)
+        task = asyncio.current_task()
+        self.connections[task] = False
+        try:
+            await self.serve(client, parser, task)
+        finally:
+            del self.connections[task]
+            client.close()
+
+    async def serve(self, client, parser, task):
+        pipelined = 0
         while True:
             try:
+                # idle connections are closed by a drain, those a request
+                # started arriving on are let finish
+                await parser.preread()
+                self.connections[task] = True
                 req, resp = await parser.parse()
-                with req, resp:
-                    await self.handler.handle(req, resp)
-                    await resp.flush()
+                unread = await self.handle(client, req, resp)
+
+                # requests already buffered behind this one are handled
+                # before the queued responses are written out together
+                pipelined += 1
+                if (resp.should_close or self.draining or pipelined >= self.conf.pipeline
+                        or not parser.head_buffered()):
+                    await client.drain()
+                    pipelined = 0
             except NoMoreData as e:
                 logger.debug('Ignore client disconnect early')
                 break
@@ -62,16 +146,47 @@ class Worker:
             except asyncio.TimeoutError as e:
                 logger.debug('Ignore client connection timeout')
                 break
-            except (LimitRequestLine, LimitRequestHeader, InvalidHeader, InvalidRequestMethod) as e:
+            except (LimitRequestLine, LimitRequestHeader, InvalidHeader,
+                    InvalidRequestLine, InvalidRequestMethod, InvalidHTTPVersion, InvalidChunk) as e:
                 logger.warning('Parsing exception {}'.format(e))
                 await self.handle_except(client, 400, 'Bad Request')
                 break
+            except LimitRequestBody as e:
+                logger.warning('Parsing exception {}'.format(e))
+                await self.handle_except(client, 413, 'Request Entity Too Large')
+                await self.linger(client)
+                break
             except Exception as e:
                 logger.warning('Unknown exception: {}'.format(e))
                 logger.exception(e)
                 await self.handle_except(client, 500, 'Internal Server Error')
                 break
-            if resp.should_close:
+            if resp.should_close or self.draining:
+                if unread:
+                    await self.linger(client)
                 break
+            self.connections[task] = False
+
+    async def shutdown(self, timeout):
+        '''
+            Close the idle connections and give the busy ones up to `timeout`
+            seconds to finish their request. Returns the number of
+            connections cut off.
+        '''
+        self.draining = True
+        await asyncio.sleep(self.IDLE_GRACE)
+        idle = [task for task, busy in self.connections.items() if not busy]
+        busy = [task for task, busy in self.connections.items() if busy]
+        for task in idle:
+            task.cancel()
+        if idle:
+            await asyncio.wait(idle)
 
-        client.close()
+        if not busy:
+            return 0
+        done, pending = await asyncio.wait(busy, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.wait(pending)
+        return len(pending)
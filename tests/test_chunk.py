@@ -1,7 +1,106 @@
 import sys
 import os.path
 import socket
+import asyncio
 
+import pytest
+
+from lin.http.parser import Reader
+from lin.http.request import ChunkReader
+from lin.http.excepts import InvalidChunk, LimitRequestHeader
+
+
+class FakeSocket:
+    def __init__(self, data, segment=None):
+        self.data = data
+        self.segment = segment
+        self.calls = 0
+
+    async def recv_into(self, buf):
+        self.calls += 1
+        size = min(len(buf), len(self.data), self.segment or len(self.data))
+        buf[:size] = self.data[:size]
+        self.data = self.data[size:]
+        return size
+
+    async def recv(self, nbytes):
+        self.calls += 1
+        size = min(nbytes, self.segment or nbytes)
+        data, self.data = self.data[:size], self.data[size:]
+        return data
+
+
+def chunked(parts, trailer=b''):
+    return b''.join(b'%X\r\n%s\r\n' % (len(part), part) for part in parts) + b'0\r\n' + trailer + b'\r\n'
+
+def decode(data, segment=None, buffer_size=8192, size=-1):
+    sock = FakeSocket(data, segment)
+    reader = Reader(sock, buffer_size)
+    body = ChunkReader(reader)
+    result = asyncio.run(body.read(size))
+    return result, body, reader, sock
+
+
+def test_decode():
+    parts = [b'hello', b' ', b'world' * 100]
+    data, body, _, _ = decode(chunked(parts))
+    assert data == b''.join(parts)
+    assert body.eof
+
+def test_decode_segmented():
+    parts = [b'a' * n for n in range(1, 40)]
+    data, _, _, _ = decode(chunked(parts), segment=1, buffer_size=16)
+    assert data == b''.join(parts)
+
+def test_extensions():
+    data, body, _, _ = decode(b'5;name=value;flag\r\nhello\r\n0;last="yes"\r\n\r\n')
+    assert data == b'hello'
+    assert body.extensions == [('last', 'yes')]
+
+def test_trailers():
+    data, body, _, _ = decode(chunked([b'hello'], b'X-Checksum: abc\r\nX-Other:  1 \r\n'))
+    assert data == b'hello'
+    assert body.trailers.get('x-checksum') == 'abc'
+    assert body.trailers.get('x-other') == '1'
+
+def test_pipelined_request_left_in_buffer():
+    data, _, reader, _ = decode(chunked([b'hello']) + b'GET / HTTP/1.1\r\n\r\n')
+    assert data == b'hello'
+    assert bytes(reader.buff.peek()) == b'GET / HTTP/1.1\r\n\r\n'
+
+def test_read_in_parts():
+    parts = [b'abc', b'defgh', b'ij']
+    sock = FakeSocket(chunked(parts))
+    body = ChunkReader(Reader(sock, 8192))
+
+    async def read_all():
+        return [part async for part in body]
+
+    assert b''.join(asyncio.run(read_all())) == b'abcdefghij'
+
+@pytest.mark.parametrize('data', [
+    b'zz\r\nhello\r\n0\r\n\r\n',
+    b'0x5\r\nhello\r\n0\r\n\r\n',
+    b'-5\r\nhello\r\n0\r\n\r\n',
+    b'5\r\nhelloXX0\r\n\r\n',
+    b'1' * (ChunkReader.LIMIT_CHUNK_LINE + 1) + b'\r\n',
+    ])
+def test_invalid_chunk(data):
+    with pytest.raises(InvalidChunk):
+        decode(data)
+
+def test_trailer_limit():
+    trailer = b'X-Pad: ' + b'a' * ChunkReader.LIMIT_TRAILER + b'\r\n'
+    with pytest.raises(LimitRequestHeader):
+        decode(chunked([b'hello'], trailer))
+
+def test_syscalls():
+    # many small chunks are decoded out of whole buffers, not line by line
+    parts = [b'x' * 10] * 1000
+    data = chunked(parts)
+    body, _, _, sock = decode(data, buffer_size=8192)
+    assert body == b''.join(parts)
+    assert sock.calls <= len(data) // 8192 + 2
 
 
 def send_chunk():
@@ -10,21 +109,21 @@ def send_chunk():
 
     tcp_client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     tcp_client.connect(('127.0.0.1', 8000))
-    
+
     tcp_client.sendall(b'POST /chunk http/1.1\r\nHost:127.0.0.1:8000\r\nAccept:*/*\r\nConnection:close\r\nTransfer-Encoding:chunked\r\nUser-Agent:Mozilla/5.0 (Windows NT 10.0; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/51.0.2704.106 Safari/537.36\r\n\r\n')
-    
+
     with open(sys.argv[1], 'rb') as f:
         print('send file size', size)
         while size > 0:
             if size > bs:
-                tcp_client.sendall("%X\r\n" % bs)
+                tcp_client.sendall(b"%X\r\n" % bs)
                 tcp_client.sendall(f.read(bs) + b'\r\n')
                 size -= bs
             else:
-                tcp_client.sendall("%X\r\n" % size)
+                tcp_client.sendall(b"%X\r\n" % size)
                 tcp_client.sendall(f.read(size) + b'\r\n')
                 break
-            
+
     tcp_client.sendall(b'0\r\n\r\n')
     print('recv response', tcp_client.recv(8192))
     tcp_client.close()
@@ -0,0 +1,90 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from lin.http.parser import HTTP_v1_x_Parser, HTTPToolsParser, httptools
+from lin.http.excepts import LimitRequestLine, LimitRequestHeader, InvalidRequestMethod
+
+
+class FakeSocket:
+    def __init__(self, data, segment=None):
+        self.data = data
+        self.segment = segment
+
+    async def recv_into(self, buf):
+        size = min(len(buf), len(self.data), self.segment or len(self.data))
+        buf[:size] = self.data[:size]
+        self.data = self.data[size:]
+        return size
+
+    async def recv_into_timeout(self, buf, timeout):
+        return await self.recv_into(buf)
+
+
+def config(**kwargs):
+    cfg = dict(buffer_size=8192, limit_request_line=0, limit_request_header=0,
+            limit_request_body=0, keepalive_timeout=5, sendfile=False)
+    cfg.update(kwargs)
+    return SimpleNamespace(**cfg)
+
+def read_head(data, segment=None, limit_request_line=0, limit_request_header=0):
+    cfg = config(limit_request_line=limit_request_line, limit_request_header=limit_request_header)
+    parser = HTTP_v1_x_Parser(FakeSocket(data, segment), cfg)
+    head, line_end = asyncio.run(parser.read_head())
+    return bytes(head), line_end
+
+
+def test_head():
+    data = b'GET / HTTP/1.1\r\nHost: a\r\n\r\n'
+    assert read_head(data) == (data, 14)
+
+def test_head_segmented():
+    data = b'\r\nGET / HTTP/1.1\r\nHost: a\r\nX: b\r\n\r\n'
+    assert read_head(data + b'GET', segment=1) == (data[2:], 14)
+
+def test_empty_header_block():
+    assert read_head(b'GET / HTTP/1.0\r\n\r\n', segment=1) == (b'GET / HTTP/1.0\r\n\r\n', 14)
+
+@pytest.mark.parametrize('segment', [None, 1])
+def test_request_line_limit(segment):
+    line = b'GET /' + b'a' * 45 + b' HTTP/1.1'
+    data = line + b'\r\n\r\n'
+    assert read_head(data, segment, limit_request_line=len(line)) == (data, len(line))
+    with pytest.raises(LimitRequestLine):
+        read_head(data, segment, limit_request_line=len(line) - 1)
+
+@pytest.mark.parametrize('segment', [None, 1])
+def test_header_limit(segment):
+    headers = b'Host: a\r\nX-Pad: ' + b'a' * 180
+    data = b'GET / HTTP/1.1\r\n' + headers + b'\r\n\r\n'
+    assert read_head(data, segment, limit_request_header=len(headers)) == (data, 14)
+    with pytest.raises(LimitRequestHeader):
+        read_head(data, segment, limit_request_header=len(headers) - 1)
+
+
+def parse(parser_cls, data):
+    parser = parser_cls(FakeSocket(data), config())
+    req, resp = asyncio.run(parser.parse())
+    return (req.method, req.uri, req.version, list(req.header), req.chunked, req.should_close(),
+            resp.should_close)
+
+@pytest.mark.skipif(httptools is None, reason='httptools is not installed')
+@pytest.mark.parametrize('data', [
+    b'GET / HTTP/1.1\r\nHost: a\r\n\r\n',
+    b'GET /a?b=c HTTP/1.0\r\nHost: a\r\nConnection: keep-alive\r\n\r\n',
+    b'POST /x HTTP/1.1\r\nHost: a\r\nTransfer-Encoding: chunked \r\n\r\n',
+    b'POST /x HTTP/1.1\r\nContent-Length:  5\t\r\nConnection: close \r\n\r\n',
+    b'GET / HTTP/1.1\r\nX-Empty:\r\nX-Dup: 1\r\nx-dup: 2\r\nUser-Agent: a b  c\r\n\r\n',
+    b'GET / HTTP/1.1\r\nUpgrade: h2c\r\nConnection: Upgrade, HTTP2-Settings\r\n\r\n',
+    b'CONNECT example.com:443 HTTP/1.1\r\nHost: example.com:443\r\n\r\n',
+    b'get / http/1.1\r\nHost: a\r\n\r\n',
+    ])
+def test_parser_parity(data):
+    assert parse(HTTPToolsParser, data) == parse(HTTP_v1_x_Parser, data)
+
+@pytest.mark.skipif(httptools is None, reason='httptools is not installed')
+@pytest.mark.parametrize('parser_cls', [HTTP_v1_x_Parser, HTTPToolsParser])
+def test_invalid_method(parser_cls):
+    with pytest.raises(InvalidRequestMethod):
+        parse(parser_cls, b'FOO / HTTP/1.1\r\n\r\n')